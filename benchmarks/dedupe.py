@@ -0,0 +1,75 @@
+'''Time and peak memory of worksheet deduplication.
+
+    python -m benchmarks.dedupe [existing rows] [new rows]
+
+Compares the old set-of-tuples dedupe with the row index: building the index
+from a worksheet and filtering a batch of new rows against it
+'''
+import os
+import random
+import sys
+import tempfile
+import tracemalloc
+from time import perf_counter
+from src.row_index import RowIndex, unique_rows
+
+
+def make_rows(count: int, start: int = 0) -> list[list]:
+    random.seed(start)
+    return [
+        [f'2024-06-{i % 30 + 1:02d}', f'{1000000 + i}', f'SKU-{i % 5000}', 'Товар ' * 5, random.randint(1, 100),
+         round(random.random() * 1000, 2), '+', '-', 'Нет данных', f'{i}-0001-1']
+        for i in range(start, start + count)
+    ]
+
+
+def old_dedupe(data: list, check_by: list) -> list:
+    '''GSheet.__deleteDuplicatesFrom before the row index'''
+    for i in range(min(len(data), len(check_by))):
+        while len(data[i]) < len(check_by[i]):
+            data[i].append('')
+        while len(data[i]) > len(check_by[i]):
+            check_by[i].append('')
+
+    data = set(tuple(
+        tuple(list(map(str, i))) for i in data
+    ))
+    check_by = set(tuple(
+        tuple(list(map(str, i))) for i in check_by
+    ))
+    return list(map(list, data - (data & check_by)))
+
+
+def measure(name: str, func):
+    '''Time of one run and peak Python memory of another one, tracemalloc slows the code down'''
+    started = perf_counter()
+    func()
+    elapsed = perf_counter() - started
+
+    tracemalloc.start()
+    result = func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{name:<28} {elapsed:8.2f}s {peak / 2 ** 20:10.1f} MiB')
+    return result
+
+
+def main(existing_count: int = 500_000, new_count: int = 50_000):
+    existing = make_rows(existing_count)
+    # half of the new rows are already in the worksheet
+    new = existing[-new_count // 2:] + make_rows(new_count - new_count // 2, existing_count)
+    print(f'{existing_count} rows in the worksheet, {len(new)} new rows')
+
+    with tempfile.TemporaryDirectory() as directory:
+        index = RowIndex('benchmark', os.path.join(directory, 'cache.sqlite3'))
+
+        old = measure('set of tuples', lambda: old_dedupe([list(r) for r in new], [list(r) for r in existing]))
+        measure('row index: rebuild', lambda: index.rebuild(existing))
+        result = measure('row index: dedupe', lambda: list(unique_rows(new, index, set())))
+
+    assert sorted(map(tuple, map(lambda r: map(str, r), result))) == sorted(map(tuple, old))
+    assert result == new[new_count // 2:]
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,35 @@
+'''Cold start time of the service: importing main and main.get_application().
+
+    python -m benchmarks.startup [runs]
+
+Every run is a fresh interpreter, so nothing is shared between the runs
+'''
+import statistics
+import subprocess
+import sys
+
+SCRIPT = '''
+from time import perf_counter
+started = perf_counter()
+import main
+imported = perf_counter()
+main.get_application()
+print(imported - started, perf_counter() - imported)
+'''
+
+
+def main(runs: int = 5):
+    imports, applications = [], []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, '-c', SCRIPT], capture_output=True, text=True, check=True
+        ).stdout.split()
+        imports.append(float(output[-2]))
+        applications.append(float(output[-1]))
+
+    print(f'import main          median {statistics.median(imports):.3f}s  max {max(imports):.3f}s')
+    print(f'get_application()    median {statistics.median(applications):.3f}s  max {max(applications):.3f}s')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -1,3 +1,8 @@
+from dotenv import load_dotenv
+
+# .env is loaded before the modules of src read their settings from the environment
+load_dotenv()
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from src.handler import router
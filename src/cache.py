@@ -0,0 +1,99 @@
+import fcntl
+import hashlib
+import json
+import os
+import sqlite3
+from contextlib import contextmanager
+from time import time
+
+# Файл кэша, общий для всех прогонов и процессов сервиса
+CACHE_PATH = os.environ.get('CACHE_PATH', 'cache.sqlite3')
+
+
+@contextmanager
+def connect(path: str = CACHE_PATH):
+    '''Connection to the cache file which commits on success and is always closed'''
+    db = sqlite3.connect(path, timeout=30)
+    try:
+        with db:
+            yield db
+    finally:
+        db.close()
+
+
+@contextmanager
+def file_lock(name: str):
+    '''Exclusive lock shared by every process and thread using the same cache file'''
+    digest = hashlib.sha1(name.encode()).hexdigest()[:16]
+    with open(f'{CACHE_PATH}.{digest}.lock', 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class DiskCache:
+    '''Key-value cache with TTL stored in a local SQLite file.
+
+    Every process opens its own connections to the same file, so whatever
+    one run has fetched is reused by the next runs and by other workers.
+    Values must be JSON serializable.
+    '''
+
+    def __init__(self, namespace: str, ttl: float, path: str = CACHE_PATH):
+        self.__namespace = namespace
+        self.__ttl = ttl
+        self.__path = path
+
+        with self.__connect() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('''
+                CREATE TABLE IF NOT EXISTS cache (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )
+            ''')
+
+    def __connect(self):
+        return connect(self.__path)
+
+    def get_entries(self, keys: list) -> dict:
+        '''Returns {key: (value, age in seconds)} for every cached key, even the expired ones'''
+        keys = list(set(map(str, keys)))
+        now = time()
+        result = {}
+        with self.__connect() as db:
+            # SQLite limits the number of query parameters
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = db.execute(
+                    'SELECT key, value, updated_at FROM cache WHERE namespace = ? AND key IN ({})'.format(
+                        ', '.join('?' * len(chunk))),
+                    [self.__namespace, *chunk]
+                )
+                for key, value, updated_at in rows:
+                    result[key] = (json.loads(value), now - updated_at)
+        return result
+
+    def get_many(self, keys: list) -> dict:
+        '''Returns {key: value} for the cached keys which are not expired'''
+        return {k: v for k, (v, age) in self.get_entries(keys).items() if age < self.__ttl}
+
+    def set_many(self, items: dict):
+        now = time()
+        with self.__connect() as db:
+            db.executemany(
+                'INSERT OR REPLACE INTO cache (namespace, key, value, updated_at) VALUES (?, ?, ?, ?)',
+                [(self.__namespace, str(k), json.dumps(v, ensure_ascii=False), now) for k, v in items.items()]
+            )
+
+    def delete_many(self, keys: list):
+        with self.__connect() as db:
+            db.executemany(
+                'DELETE FROM cache WHERE namespace = ? AND key = ?',
+                [(self.__namespace, str(k)) for k in keys]
+            )
@@ -0,0 +1,50 @@
+'''Syncs every market of markets.json, or the chosen ones, without the web server.
+
+    python -m src.cli --start 2024-06-01T00:00:00Z --end 2024-06-30T00:00:00Z [--shop NAME ...] [--marketplace ozon]
+
+Prints the summary of the run as json, the exit code is 1 if any sync failed
+'''
+import argparse
+import json
+import sys
+from dotenv import load_dotenv
+
+# .env is loaded before the modules of src read their settings from the environment
+load_dotenv()
+
+from src.jobs import JobQueue, JOB_WORKERS, JOB_ACCOUNT_CONCURRENCY
+from src import fanout
+from src.markets import MarketRegistry, MARKETS_PATH
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = argparse.ArgumentParser(description='Sync the markets of markets.json')
+    args.add_argument('--start', required=True, help='start of the period, ISO 8601')
+    args.add_argument('--end', required=True, help='end of the period, ISO 8601')
+    args.add_argument('--shop', action='append', dest='shops', help='sync only this shop, can be repeated')
+    args.add_argument('--marketplace', help='sync only the markets of this marketplace')
+    args.add_argument('--markets', default=MARKETS_PATH, help='path to markets.json')
+    args.add_argument('--concurrency', type=int, default=JOB_WORKERS, help='syncs running at the same time')
+    args.add_argument('--account-concurrency', type=int, default=JOB_ACCOUNT_CONCURRENCY,
+                      help='syncs of one client_id running at the same time')
+    args = args.parse_args(argv)
+
+    markets = fanout.select_markets(MarketRegistry(args.markets).all(), args.shops, args.marketplace)
+    if not markets:
+        print('No markets to sync', file=sys.stderr)
+        return 1
+
+    queue = JobQueue(args.concurrency, len(markets), args.account_concurrency)
+    try:
+        batch = fanout.start_batch(queue, markets, args.start, args.end)
+        queue.wait(list(batch['jobs'].values()))
+        result = fanout.summary(queue, batch)
+    finally:
+        queue.close()
+
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 1 if result['counts'].get('failed') else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
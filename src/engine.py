@@ -0,0 +1,59 @@
+import asyncio
+import inspect
+import os
+
+# Сколько запросов к маркетплейсу может выполняться одновременно за один прогон
+CONCURRENCY = int(os.environ.get('PARSER_CONCURRENCY', 4))
+
+
+class AsyncParser:
+    '''Awaitable variant of a marketplace parser.
+
+    Every public builder of the wrapped parser becomes a coroutine which runs
+    the builder in a worker thread under the global concurrency limit.
+    The wrapped parser keeps its caches and pooled sessions, so builders
+    started concurrently still share them.
+    '''
+
+    def __init__(self, parser, limit: int = CONCURRENCY):
+        self.__parser = parser
+        self.__semaphore = asyncio.Semaphore(limit)
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        return self.__semaphore
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.__parser, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        async def builder(*args, **kwargs):
+            async with self.__semaphore:
+                return await asyncio.to_thread(attr, *args, **kwargs)
+
+        return builder
+
+
+async def concat(*builders) -> list[list]:
+    '''Awaits builders concurrently and joins their rows in the given order'''
+    parts = await asyncio.gather(*builders)
+    return [row for part in parts if part for row in part]
+
+
+async def call(get_data, *args, semaphore: asyncio.Semaphore, blocking: bool = False):
+    '''Calls GetData with args and returns its result.
+
+    GetData may be a coroutine function or a function returning an awaitable
+    (e.g. lambda: concat(...)), such functions are called in the event loop, so they
+    must not block. Blocking ones are passed with blocking=True and run in a worker
+    thread under the semaphore.
+    '''
+    if blocking:
+        async with semaphore:
+            data = await asyncio.to_thread(get_data, *args)
+    else:
+        data = get_data(*args)
+    if inspect.isawaitable(data):
+        data = await data
+    return data
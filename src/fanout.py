@@ -0,0 +1,75 @@
+import threading
+import uuid
+from collections import Counter, OrderedDict
+from datetime import datetime
+from src.jobs import JobQueue, JOB_HISTORY, FINISHED, job_params
+
+_batches: OrderedDict[str, dict] = OrderedDict()
+_batches_lock = threading.Lock()
+
+
+def select_markets(markets: list[dict], shops: list[str] | None = None, marketplace: str | None = None) -> list[dict]:
+    '''Markets with the given names and marketplace, every market if they are not given'''
+    return [
+        m for m in markets
+        if (not shops or m['name'] in shops)
+        and (not marketplace or m['marketplace'].lower() == marketplace.lower())
+    ]
+
+
+def start_batch(queue: JobQueue, markets: list[dict], startDate: str, endDate: str) -> dict:
+    '''Queues a sync of every market for the period.
+
+    The batch is not limited by the size of the queue: the number of workers limits
+    syncs globally and the account limit of the queue limits syncs of one client_id
+    '''
+    jobs = {}
+    for market in markets:
+        job = queue.submit(
+            market['name'], job_params(market, startDate, endDate), market.get('spreadsheet_url', ''),
+            (market['name'], startDate, endDate), market['client_id'], limit=False
+        )
+        jobs[market['name']] = job['id']
+
+    batch = {
+        'id': uuid.uuid4().hex,
+        'startDate': startDate,
+        'endDate': endDate,
+        'jobs': jobs,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+    }
+    with _batches_lock:
+        _batches[batch['id']] = batch
+        while len(_batches) > JOB_HISTORY:
+            _batches.popitem(last=False)
+    return batch
+
+
+def get_batch(batch_id: str) -> dict | None:
+    with _batches_lock:
+        return _batches.get(batch_id)
+
+
+def summary(queue: JobQueue, batch: dict) -> dict:
+    '''State of the batch: counts of jobs by state and the result of every shop'''
+    shops = {}
+    for shop, job_id in batch['jobs'].items():
+        # only finished jobs are dropped from the history
+        job = queue.get(job_id) or {'state': 'unknown', 'error': None, 'sheets': {}, 'started_at': None, 'finished_at': None}
+        shops[shop] = {
+            'job_id': job_id,
+            'state': job['state'],
+            'error': job['error'],
+            'sheets': job['sheets'],
+            'started_at': job['started_at'],
+            'finished_at': job['finished_at'],
+        }
+
+    counts = Counter(s['state'] for s in shops.values())
+    return {
+        'id': batch['id'],
+        'state': 'done' if all(s['state'] in (*FINISHED, 'unknown') for s in shops.values()) else 'running',
+        'total': len(shops),
+        'counts': dict(counts),
+        'shops': shops,
+    }
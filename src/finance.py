@@ -0,0 +1,157 @@
+import numpy as np
+import pandas as pd
+
+# Услуги, наличие которых в операции отмечается "+" / "-"
+RETURN_SERVICES = ['MarketplaceNotDeliveredCostItem', 'MarketplaceReturnAfterDeliveryCostItem']
+FLAG_SERVICES = [
+    'MarketplaceServiceItemReturnAfterDelivToCustomer',
+    'MarketplaceServiceItemReturnNotDelivToCustomer',
+    'MarketplaceServiceItemReturnPartGoodsCustomer',
+    'MarketplaceServiceItemDirectFlowLogistic',
+    'MarketplaceServiceItemReturnFlowLogistic',
+]
+# Услуги, стоимость которых делится между товарами операции
+PRICE_SERVICES = [
+    'MarketplaceServiceItemDirectFlowTrans',
+    'MarketplaceServiceItemDelivToCustomer',
+    'MarketplaceServiceItemReturnFlowTrans',
+]
+
+
+class _Services:
+    '''Services of the operations parsed once into an operation x service type matrix.
+    Services come either as {"name": ..., "price": ...} or as {name: {"price": ...}}
+    '''
+
+    def __init__(self, operations: list[dict]):
+        ops, names, prices = [], [], []
+        for op, item in enumerate(operations):
+            for service in item['services']:
+                if 'name' in service:
+                    ops.append(op)
+                    names.append(service['name'])
+                    prices.append(service.get('price', 0))
+                else:
+                    for name, value in service.items():
+                        ops.append(op)
+                        names.append(name)
+                        prices.append(value.get('price', 0) if isinstance(value, dict) else 0)
+
+        codes, self.__types = pd.factorize(pd.Series(names, dtype=object))
+        ops = np.asarray(ops, dtype=int)
+        prices = pd.to_numeric(pd.Series(prices, dtype=object), errors='coerce').fillna(0).to_numpy(dtype=float)
+
+        self.__present = np.zeros((len(operations), len(self.__types)), dtype=bool)
+        self.__present[ops, codes] = True
+
+        # the first price of a service type in the operation wins
+        self.__prices = np.zeros((len(operations), len(self.__types)), dtype=float)
+        self.__prices[ops[::-1], codes[::-1]] = prices[::-1]
+
+    def __columns(self, names: list[str]) -> np.ndarray:
+        '''Service types whose name contains one of names'''
+        return np.array([any(n in t for n in names) for t in self.__types], dtype=bool)
+
+    def has(self, *names: str) -> np.ndarray:
+        return self.__present[:, self.__columns(names)].any(axis=1)
+
+    def price(self, name: str) -> np.ndarray:
+        columns = np.flatnonzero(np.asarray(self.__types) == name)
+        if not len(columns):
+            return np.zeros(len(self.__prices))
+        return self.__prices[:, columns[0]]
+
+
+def prepare_order_incomes(operations: list[dict], warehouse_names: dict, goods_info: dict) -> list[list]:
+    '''Builds "Начисления по товарам" rows from /v3/finance/transaction/list operations.
+
+    Services are parsed once into an operation x service table, the per-operation
+    columns are computed on whole arrays and then repeated for every item of the operation
+    '''
+    if not operations:
+        return []
+
+    ops = pd.DataFrame({
+        'operation_date': [i['operation_date'] for i in operations],
+        'operation_type_name': [i['operation_type_name'] for i in operations],
+        'operation_id': [i['operation_id'] for i in operations],
+        'order_date': [i['posting']['order_date'] for i in operations],
+        'warehouse_id': [i['posting']['warehouse_id'] for i in operations],
+        'posting_number': [i['posting']['posting_number'] for i in operations],
+        'sale_commission': [i['sale_commission'] for i in operations],
+        'amount': [i['amount'] for i in operations],
+        'goods_num': [len(i['items']) for i in operations],
+    }, dtype=object)
+    # operations without items give no rows, so they are divided by 1 just to avoid zero division
+    goods_num = np.maximum(ops['goods_num'].to_numpy(dtype=float), 1)
+
+    services = _Services(operations)
+
+    def flag(*names: str) -> np.ndarray:
+        return np.where(services.has(*names), '+', '-')
+
+    def price(name: str) -> pd.Series:
+        value = pd.Series(services.price(name) / goods_num)
+        return value.astype(object).where(value != 0, '-')
+
+    pickup = services.has('MarketplaceServiceItemPickup')
+    dropoff = services.has('MarketplaceServiceItemDropoffPPZ')
+
+    columns = pd.DataFrame({
+        'operation_date': ops['operation_date'],
+        'operation_type_name': ops['operation_type_name'],
+        'operation_id': ops['operation_id'],
+        'order_date': ops['order_date'],
+        'warehouse': ops['warehouse_id'].map(warehouse_names),
+        'operation_date_2': ops['operation_date'],
+        'returned': flag(*RETURN_SERVICES),
+        'sale_commission': ops['sale_commission'],
+        'posting_number': ops['posting_number'],
+        'delivery': np.select([pickup, dropoff], ['Pick-Up', 'Drop-off'], 'Нет данных'),
+        **{name: price(name) for name in PRICE_SERVICES},
+        **{name: flag(name) for name in FLAG_SERVICES},
+        'amount': pd.Series(ops['amount'].to_numpy(dtype=float) / goods_num),
+    })
+
+    # one row per item of the operation
+    items = pd.DataFrame.from_records(
+        [(op, good['sku']) for op, item in enumerate(operations) for good in item['items']],
+        columns=['op', 'sku']
+    )
+    if items.empty:
+        return []
+    rows = columns.iloc[items['op'].to_numpy()].reset_index(drop=True)
+
+    skus = items['sku']
+    info = {sku: goods_info.get(sku, {}) for sku in skus.unique()}
+    offer_ids = skus.map({sku: i.get('offer_id', 'Нет данных') for sku, i in info.items()})
+    names = skus.map({sku: i.get('name', 'Нет данных') for sku, i in info.items()})
+
+    result = pd.DataFrame({
+        'operation_date': rows['operation_date'],
+        'operation_type_name': rows['operation_type_name'],
+        'operation_id': rows['operation_id'],
+        'order_date': rows['order_date'],
+        'warehouse': rows['warehouse'],
+        'operation_date_2': rows['operation_date_2'],
+        'sku': skus.astype(object),
+        'offer_id': offer_ids,
+        'name': names,
+        'count': 1,
+        'returned': rows['returned'],
+        'sale_commission': rows['sale_commission'],
+        'posting_number': rows['posting_number'],
+        'delivery': rows['delivery'],
+        'direct_flow_trans': rows['MarketplaceServiceItemDirectFlowTrans'],
+        'deliv_to_customer': rows['MarketplaceServiceItemDelivToCustomer'],
+        'return_flow_trans': rows['MarketplaceServiceItemReturnFlowTrans'],
+        'return_after_deliv': rows['MarketplaceServiceItemReturnAfterDelivToCustomer'],
+        'return_not_deliv': rows['MarketplaceServiceItemReturnNotDelivToCustomer'],
+        'return_part_goods': rows['MarketplaceServiceItemReturnPartGoodsCustomer'],
+        'direct_flow_logistic': rows['MarketplaceServiceItemDirectFlowLogistic'],
+        'no_data': 'Нет данных',
+        'return_flow_logistic': rows['MarketplaceServiceItemReturnFlowLogistic'],
+        'amount': rows['amount'],
+    }, dtype=object)
+
+    return result.to_numpy().tolist()
@@ -12,8 +12,18 @@ class Market(BaseModel):
     performance_secret: str
     client_id: str
     client_key: str
-    spreadsheet_url: str
+    spreadsheet_url: str = ''
+    # Куда сохранять выгрузку: gsheet, sqlite или parquet
+    sink: str = 'gsheet'
+    sink_path: str | None = None
 
 class Markets(BaseModel):
     markets: list[Market]
 
+
+class SyncAll(BaseModel):
+    startDate: str
+    endDate: str
+    # Только эти магазины / только этот маркетплейс, по умолчанию все из markets.json
+    shops: list[str] | None = None
+    marketplace: str | None = None
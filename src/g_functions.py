@@ -1,10 +1,14 @@
 from __future__ import annotations
+import threading
+from functools import cache
 import gspread
-from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
 from datetime import datetime
 from loguru import logger
+from gspread.utils import absolute_range_name
 from xlsxwriter.utility import xl_col_to_name
+from src.row_index import RowIndex, unique_rows
+from src.cache import file_lock
+from src.sinks import Sink
 
 
 # Путь к файлу JSON с учетными данными сервисного аккаунта
@@ -14,27 +18,58 @@ SERVICE_ACCOUNT_FILE = 'key.json'
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets',
           'https://www.googleapis.com/auth/drive']
 
-# Авторизация
-credentials = Credentials.from_service_account_file(
-    SERVICE_ACCOUNT_FILE, scopes=SCOPES)
 
-# Авторизация для gspread
-gc = gspread.authorize(credentials)
+# Клиенты создаются при первом обращении, а не при импорте модуля
+@cache
+def get_credentials():
+    from google.oauth2.service_account import Credentials
+    return Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
 
-# Авторизация для Google Drive API
-drive_service = build('drive', 'v3', credentials=credentials)
 
-class GSheet:
+@cache
+def get_gspread_client() -> gspread.Client:
+    return gspread.authorize(get_credentials())
+
+
+@cache
+def get_drive_service():
+    '''Google Drive API client built from the discovery document shipped with googleapiclient'''
+    from googleapiclient.discovery import build
+    return build('drive', 'v3', credentials=get_credentials(), static_discovery=True, cache_discovery=False)
+
+
+_spreadsheets: dict[str, gspread.Spreadsheet] = {}
+_spreadsheets_lock = threading.Lock()
+
+
+def open_spreadsheet(url: str) -> gspread.Spreadsheet:
+    '''Spreadsheets are opened once per process, later runs reuse the handle'''
+    with _spreadsheets_lock:
+        if url not in _spreadsheets:
+            _spreadsheets[url] = get_gspread_client().open_by_url(url)
+        return _spreadsheets[url]
+
+
+def __getattr__(name: str):
+    # gc and drive_service used to be module attributes
+    if name == 'gc':
+        return get_gspread_client()
+    if name == 'drive_service':
+        return get_drive_service()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+class GSheet(Sink):
 
     def __init__(self, spreadsheet, dateStart: datetime, dateEnd: datetime):
         self.__spreadsheet = spreadsheet
         self.__worksheets = {}
+        self.__pending = {}
         self.__date_start = dateStart
         self.__date_end = dateEnd
 
     def create(url: str, startDate: datetime, endDate: datetime) -> GSheet:
 
-        spreadsheet = gc.open_by_url(url)
+        spreadsheet = open_spreadsheet(url)
 
         # ID созданного Google Sheet
         spreadsheet_id = spreadsheet.id
@@ -44,9 +79,9 @@ class GSheet:
         folder_id = '16OxeWAKGglrIwix1mlKdDuRBmBN7MdZZ'
 
         # Перемещаем файл в указанную папку
-        file = drive_service.files().get(fileId=spreadsheet_id, fields='parents').execute()
+        file = get_drive_service().files().get(fileId=spreadsheet_id, fields='parents').execute()
         previous_parents = ",".join(file.get('parents'))
-        file = drive_service.files().update(
+        file = get_drive_service().files().update(
             fileId=spreadsheet_id,
             addParents=folder_id,
             removeParents=previous_parents,
@@ -58,55 +93,116 @@ class GSheet:
         return GSheet(spreadsheet, startDate, endDate)
 
     def __get_worksheet(self, worksheet_name: str, create_on_fail: bool = False):
+        if worksheet_name not in self.__worksheets:
+            # one metadata request gives every worksheet of the spreadsheet
+            self.__worksheets.update({ws.title: ws for ws in self.__spreadsheet.worksheets()})
         if worksheet_name not in self.__worksheets:
             self.__worksheets[worksheet_name] = self.__spreadsheet.worksheet(worksheet_name)
 
-                
         return self.__worksheets[worksheet_name]
 
+    def __get_pending(self, worksheet_name: str) -> dict:
+        if worksheet_name not in self.__pending:
+            worksheet = self.__get_worksheet(worksheet_name, True)
+
+            # the worksheet is downloaded only when its row index has to be (re)built
+            index = RowIndex(f'{self.__spreadsheet.id}/{worksheet.id}')
+            if index.state() is None:
+                index.rebuild(worksheet.get_all_values())
+
+            self.__pending[worksheet_name] = {
+                'worksheet': worksheet, 'index': index, 'rows': [], 'digests': set()
+            }
+        return self.__pending[worksheet_name]
+
     def put_data_in_ws(self, data: list[list], worksheet_name: str):
-        
-        worksheet = self.__get_worksheet(worksheet_name, True)
-        current_data = worksheet.get_all_values()
+        '''Adds the rows to the write buffer, they are sent to the spreadsheet by flush()'''
+        pending = self.__get_pending(worksheet_name)
 
         if worksheet_name != 'Реклама':
-            data = self.__deleteDuplicatesFrom(data, current_data)
-        if not data:
+            data = self.__deleteDuplicatesFrom(data, pending)
+        pending['rows'].extend(data)
+
+    def flush(self):
+        '''Writes the buffered rows of every worksheet with one structural and one values request.
+
+        Other jobs and people may write to the spreadsheet too, so the last rows are
+        checked right before the write under a lock of the spreadsheet, and a worksheet
+        which does not end at the row its index says is read again
+        '''
+        pending = {name: p for name, p in self.__pending.items() if p['rows']}
+        self.__pending = {}
+        if not pending:
             return
 
-        dates = self.__get_dates(current_data)
-        worksheet.update(dates, f'B1:B{len(dates)}')
-
-        first_row, _ = self.__get_last_row_and_column(current_data)
-        _, last_column = self.__get_last_row_and_column(data)
-        last_row = first_row + len(data)
-        r = f'A{first_row}:{last_column}{last_row+1}'
-
-        worksheet.add_rows(len(data))
-        worksheet.update(data, r)
-
-    def __deleteDuplicatesFrom(self, data: list, check_by: list) -> list:
-        for i in range(min(len(data), len(check_by))):
-            while len(data[i]) < len(check_by[i]):
-                data[i].append('')
-            while len(data[i]) > len(check_by[i]):
-                check_by[i].append('')
-
-        data = set(tuple(
-            tuple(list(map(str, i))) for i in data
-        ))
-        check_by = set(tuple(
-            tuple(list(map(str, i))) for i in check_by
-        ))
-        return list(map(list, data - (data & check_by)))
-
-    def __get_dates(self, data: list) -> list:
+        with file_lock(f'spreadsheet:{self.__spreadsheet.id}'):
+            states = {name: p['index'].state() for name, p in pending.items()}
+            # the last row of the index and the row after it, across all columns:
+            # column A alone may be empty at the end of a worksheet, e.g. in "Реклама"
+            probes = self.__spreadsheet.values_batch_get(
+                [absolute_range_name(name, self.__probe_range(state)) for name, state in states.items()]
+            ).get('valueRanges', [])
+
+            requests, ranges, written = [], [], []
+            for (name, p), probe in zip(pending.items(), probes):
+                state = states[name]
+                if state is None or not self.__ends_at(probe.get('values', []), state['row_count']):
+                    logger.debug(f'{name} was changed outside of the index, reading it again')
+                    p['index'].rebuild(p['worksheet'].get_all_values())
+                    state = p['index'].state()
+                    if name != 'Реклама':
+                        p['rows'] = list(unique_rows(p['rows'], p['index'], set()))
+                rows = p['rows']
+                if not rows:
+                    continue
+
+                dates = self.__get_dates(state['period_header'])
+
+                first_row = state['row_count'] + 1
+                _, last_column = self.__get_last_row_and_column(rows)
+                last_row = first_row + len(rows)
+
+                requests.append({'appendDimension': {
+                    'sheetId': p['worksheet'].id, 'dimension': 'ROWS', 'length': len(rows)
+                }})
+                ranges.append({'range': absolute_range_name(name, f'B1:B{len(dates)}'), 'values': dates})
+                ranges.append({'range': absolute_range_name(name, f'A{first_row}:{last_column}{last_row+1}'), 'values': rows})
+                written.append(p)
+
+            if not written:
+                return
+            self.__spreadsheet.batch_update({'requests': requests})
+            self.__spreadsheet.values_batch_update({'valueInputOption': 'RAW', 'data': ranges})
+
+            for p in written:
+                p['index'].append(p['rows'])
+        logger.debug(f'{sum(len(p["rows"]) for p in written)} rows written to {len(written)} worksheets')
+
+    @staticmethod
+    def __probe_range(state: dict | None) -> str:
+        row_count = state['row_count'] if state else 0
+        return f'{row_count}:{row_count + 1}' if row_count else '1:1'
+
+    @staticmethod
+    def __ends_at(values: list[list], row_count: int) -> bool:
+        '''Whether the probed rows show that row_count is the last non-empty row.
+        The API drops trailing empty rows and cells, so the probe of an empty row is missing
+        '''
+        if not row_count:
+            return not values
+        return len(values) == 1 and any(cell != '' for cell in values[0])
+
+    def __deleteDuplicatesFrom(self, data: list, pending: dict) -> list:
+        # rows buffered earlier in this run are not in the index yet, their digests are in pending
+        return list(unique_rows(data, pending['index'], pending['digests']))
+
+    def __get_dates(self, period_header: bool) -> list:
         res = []
         
         actualization_date = datetime.now()
         actualization_date = actualization_date.strftime("%d.%m.%Y %H:%M")
         
-        if data[0][0] == 'Дата начала выгрузки':
+        if period_header:
             res.append([self.__date_start.strftime("%d.%m.%Y")])
             res.append([self.__date_end.strftime("%d.%m.%Y")])
         res.append([actualization_date])
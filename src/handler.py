@@ -1,10 +1,10 @@
-from fastapi import APIRouter, BackgroundTasks
+from fastapi import APIRouter
 from src.form import *
-from src.program import run
+from src.jobs import get_queue, close_queue, job_params, QueueFull
+from src import fanout
+from src.markets import registry
 from fastapi import Request
 import sys
-import json
-import os
 
 sys.tracebacklimit = 3
 
@@ -15,62 +15,97 @@ def f(data: Request):
     return 200
 
 @router.post('/api/req')
-async  def start_programm(data: Request, background_tasks: BackgroundTasks):
-    if not os.path.exists('markets.json'):
+async  def start_programm(data: Request):
+    if not registry.exists():
         return {'ok': False, 'status': 400, 'error': 'No markets data'}
 
-    market = None
-
     data = await data.json()
     if 'input' in data:
         data = data['input']
     if 'body' in data:
         data = data['body']
 
-    with open('markets.json') as f:
-        markets = json.load(f)['markets']
-
-        for m in markets:
-            if m['name'] == data['shopName']:
-                market = m
-
+    market = registry.get(data['shopName'])
     if not market:
         return {'ok': False, 'status': 401, 'error': 'Market is not found'}
 
     
-    result = run(
-        market['marketplace'], m['spreadsheet_url'], market['performance_key'], 
-        market['performance_secret'], market['client_id'], 
-        market['client_key'], data['startDate'], data['endDate'],
-        background_tasks
-    )
+    try:
+        job = get_queue().submit(
+            market['name'], job_params(market, data['startDate'], data['endDate']), market['spreadsheet_url'],
+            (market['name'], data['startDate'], data['endDate']), market['client_id']
+        )
+    except QueueFull:
+        return {'ok': False, 'status': 429, 'error': 'Too many jobs in the queue, try again later'}
     
     response = {
         "ok": True,
         "status": 200,
-        "sheet_url": result
+        "job_id": job['id'],
+        "sheet_url": job['sheet_url']
     }
     
     return response
 
 
+@router.get('/api/jobs/{job_id}')
+async  def get_job(job_id: str):
+    job = get_queue().get(job_id)
+    if not job:
+        return {'ok': False, 'status': 404, 'error': 'Job is not found'}
+
+    return {'ok': True, 'status': 200, 'job': job}
+
+
+@router.post('/api/req_all')
+async  def start_all(data: SyncAll):
+    if not registry.exists():
+        return {'ok': False, 'status': 400, 'error': 'No markets data'}
+
+    markets = fanout.select_markets(registry.all(), data.shops, data.marketplace)
+
+    if not markets:
+        return {'ok': False, 'status': 401, 'error': 'Markets are not found'}
+
+    batch = fanout.start_batch(get_queue(), markets, data.startDate, data.endDate)
+
+    return {'ok': True, 'status': 200, 'batch_id': batch['id'], 'jobs': batch['jobs']}
+
+
+@router.get('/api/batches/{batch_id}')
+async  def get_batch(batch_id: str):
+    batch = fanout.get_batch(batch_id)
+    if not batch:
+        return {'ok': False, 'status': 404, 'error': 'Batch is not found'}
+
+    return {'ok': True, 'status': 200, 'batch': fanout.summary(get_queue(), batch)}
+
+
+@router.on_event('startup')
+def start_jobs():
+    # workers are forked before the first request, so they are warm when it comes
+    get_queue()
+
+
+@router.on_event('shutdown')
+def stop_jobs():
+    close_queue()
+
+
 @router.post('/api/markets')
-async  def save_markets(data: Markets):
-    with open('markets.json', 'w') as f:
-        f.write(data.model_dump_json())
+def save_markets(data: Markets):
+    registry.save(data.model_dump()['markets'])
 
     return 200
 
 @router.get('/api/markets')
 async  def get_markets():
-    if not os.path.exists('markets.json'):
+    if not registry.exists():
         return {'markets': []}
 
-    with open('markets.json') as f:
-        data = json.load(f)
-
     response = {
-        'market_names': [m['name'] for m in data['markets']]
+        'market_names': registry.names(),
+        'version': registry.version
     }
 
     return response
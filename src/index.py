@@ -0,0 +1,11 @@
+from typing import Callable, Hashable, Iterable
+
+
+def index_by(rows: Iterable, key: Callable[[object], Hashable], value: Callable[[object], object] = lambda row: row) -> dict:
+    '''Builds a hash index of rows: {key(row): value(row)}.
+    When several rows have the same key the first one wins, like a linear search would find it
+    '''
+    index = {}
+    for row in rows:
+        index.setdefault(key(row), value(row))
+    return index
@@ -0,0 +1,302 @@
+import itertools
+import multiprocessing
+import os
+import queue
+import resource
+import threading
+import uuid
+from time import monotonic, sleep
+from collections import OrderedDict
+from datetime import datetime
+from loguru import logger
+from src import program
+from src.g_functions import SERVICE_ACCOUNT_FILE, get_gspread_client
+from src.session import close_sessions
+
+# Сколько синхронизаций выполняется одновременно и сколько может ждать в очереди
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_QUEUE_SIZE = int(os.environ.get('JOB_QUEUE_SIZE', 20))
+# Сколько синхронизаций одного аккаунта маркетплейса (client_id) выполняется одновременно
+JOB_ACCOUNT_CONCURRENCY = int(os.environ.get('JOB_ACCOUNT_CONCURRENCY', 1))
+# Сколько завершенных задач хранится для /api/jobs/{id}
+JOB_HISTORY = int(os.environ.get('JOB_HISTORY', 1000))
+# Воркер перезапускается после стольких задач или если занимает больше стольких мегабайт памяти
+JOB_WORKER_MAX_JOBS = int(os.environ.get('JOB_WORKER_MAX_JOBS', 50))
+JOB_WORKER_MAX_RSS_MB = float(os.environ.get('JOB_WORKER_MAX_RSS_MB', 1024))
+
+FINISHED = ('done', 'failed')
+
+
+class QueueFull(Exception):
+    pass
+
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def _rss_mb() -> float:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except OSError:
+        # peak instead of current memory where there is no procfs
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def job_params(market: dict, startDate: str, endDate: str) -> dict:
+    '''Arguments of program.execute for a market from markets.json'''
+    return {
+        'marketplace': market['marketplace'],
+        'spreadsheet_url': market.get('spreadsheet_url', ''),
+        'performance_key': market['performance_key'],
+        'performance_secret': market['performance_secret'],
+        'client_id': market['client_id'],
+        'client_key': market['client_key'],
+        'startDate': startDate,
+        'endDate': endDate,
+        'sink': market.get('sink', 'gsheet'),
+        'sink_path': market.get('sink_path'),
+        'shop_name': market['name'],
+    }
+
+
+def _worker(tasks: multiprocessing.Queue, events: multiprocessing.Queue):
+    '''Runs jobs from tasks one by one and reports their progress to events.
+
+    The worker lives for many jobs, so HTTP sessions, performance tokens, the Google
+    client and opened spreadsheets are reused. It exits with code 0 after
+    JOB_WORKER_MAX_JOBS jobs or when it takes more than JOB_WORKER_MAX_RSS_MB of memory,
+    the queue starts a fresh one instead
+    '''
+    if os.path.exists(SERVICE_ACCOUNT_FILE):
+        try:
+            get_gspread_client()
+        except Exception:
+            logger.exception('Failed to warm up the Google client:')
+
+    for done in itertools.count(1):
+        task = tasks.get()
+        if task is None:
+            return
+        job_id, params = task
+
+        events.put((job_id, 'running', os.getpid()))
+        try:
+            program.execute(**params, progress=lambda sheet, state: events.put((job_id, 'sheet', (sheet, state))))
+        except Exception as e:
+            logger.exception(f'Job {job_id} failed:')
+            events.put((job_id, 'failed', f'{type(e).__name__}: {e}'))
+        else:
+            events.put((job_id, 'done', None))
+
+        rss = _rss_mb()
+        if done >= JOB_WORKER_MAX_JOBS or rss > JOB_WORKER_MAX_RSS_MB:
+            logger.info(f'Job worker {os.getpid()} is recycled after {done} jobs, {rss:.0f} MB')
+            close_sessions()
+            return
+
+
+class JobQueue:
+    '''Syncs run by a fixed pool of worker processes.
+
+    submit() returns at once with the job, at most max_queued jobs can wait
+    for a worker, further submits raise QueueFull. A submit with the key of a job
+    which is queued or running is attached to that job. Jobs of one account run at
+    most account_limit at a time, others of the account wait while jobs of other
+    accounts go ahead of them. The state and per-sheet
+    progress of a job are available with get() while it runs and after it finishes
+    '''
+
+    def __init__(self, workers: int = JOB_WORKERS, max_queued: int = JOB_QUEUE_SIZE,
+                 account_limit: int = JOB_ACCOUNT_CONCURRENCY):
+        self.__max_queued = max_queued
+        self.__account_limit = account_limit
+        # jobs are handed to the workers only when one of them is free, so the limits can be applied here
+        self.__waiting: list[str] = []
+        self.__params: dict[str, dict] = {}
+        self.__dispatched: set[str] = set()
+        self.__jobs: OrderedDict[str, dict] = OrderedDict()
+        # key -> id of the queued or running job with that key and back
+        self.__active: dict[tuple, str] = {}
+        self.__keys: dict[str, tuple] = {}
+        self.__lock = threading.Lock()
+        self.__tasks = multiprocessing.Queue()
+        self.__events = multiprocessing.Queue()
+        self.__workers = [self.__start_worker() for _ in range(workers)]
+        self.__running: dict[int, str] = {}
+        self.__closed = False
+
+        threading.Thread(target=self.__listen, daemon=True).start()
+
+    def __start_worker(self) -> multiprocessing.Process:
+        process = multiprocessing.Process(target=_worker, args=(self.__tasks, self.__events), daemon=True)
+        process.start()
+        return process
+
+    def submit(self, shop: str, params: dict, sheet_url: str = '', key: tuple | None = None,
+               account: str | None = None, limit: bool = True) -> dict:
+        '''Queues program.execute(**params) and returns the job.
+        With limit=False the job is queued even if the queue is full and is not counted
+        against the limit of the other submits, e.g. jobs of a fan-out batch
+        '''
+        with self.__lock:
+            if key is not None and key in self.__active:
+                job = self.__jobs[self.__active[key]]
+                job['requests'] += 1
+                logger.info(f'Request for {shop} is attached to job {job["id"]}')
+                return self.__copy(job)
+
+            # jobs handed to a worker stay 'queued' until it reports, they are not waiting any more
+            queued = sum(1 for job_id in self.__waiting if self.__jobs[job_id]['limited'])
+            if limit and queued >= self.__max_queued:
+                raise QueueFull(f'{queued} jobs are already waiting')
+
+            job = {
+                'id': uuid.uuid4().hex,
+                'shop': shop,
+                'account': account,
+                'limited': limit,
+                'state': 'queued',
+                'sheet_url': sheet_url,
+                'sheets': {},
+                'error': None,
+                'requests': 1,
+                'created_at': _now(),
+                'started_at': None,
+                'finished_at': None,
+            }
+            self.__jobs[job['id']] = job
+            if key is not None:
+                self.__active[key] = job['id']
+                self.__keys[job['id']] = key
+            self.__prune()
+            self.__waiting.append(job['id'])
+            self.__params[job['id']] = params
+            logger.info(f'Job {job["id"]} for {shop} is queued')
+            self.__dispatch()
+            return self.__copy(job)
+
+    def get(self, job_id: str) -> dict | None:
+        with self.__lock:
+            job = self.__jobs.get(job_id)
+            return self.__copy(job) if job else None
+
+    def wait(self, job_ids: list[str], timeout: float | None = None) -> list[dict]:
+        '''Waits until the jobs finish and returns them'''
+        deadline = None if timeout is None else monotonic() + timeout
+        while True:
+            jobs = [self.get(job_id) for job_id in job_ids]
+            if all(job is None or job['state'] in FINISHED for job in jobs):
+                return jobs
+            if deadline is not None and monotonic() > deadline:
+                return jobs
+            sleep(0.5)
+
+    def close(self, timeout: float = 5):
+        self.__closed = True
+        for _ in self.__workers:
+            self.__tasks.put(None)
+        for process in self.__workers:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+
+    def __copy(self, job: dict) -> dict:
+        return {**job, 'sheets': dict(job['sheets'])}
+
+    def __dispatch(self):
+        '''Hands waiting jobs to the free workers in order, skipping accounts at their limit'''
+        for job_id in list(self.__waiting):
+            if len(self.__dispatched) >= len(self.__workers):
+                return
+            account = self.__jobs[job_id]['account']
+            if account is not None and sum(
+                    self.__jobs[i]['account'] == account for i in self.__dispatched) >= self.__account_limit:
+                continue
+
+            self.__waiting.remove(job_id)
+            self.__dispatched.add(job_id)
+            self.__tasks.put((job_id, self.__params.pop(job_id)))
+
+    def __finish(self, job: dict, state: str, error: str | None):
+        job.update(state=state, error=error, finished_at=_now())
+        key = self.__keys.pop(job['id'], None)
+        if key is not None:
+            del self.__active[key]
+        self.__dispatched.discard(job['id'])
+        self.__dispatch()
+
+    def __prune(self):
+        finished = [job_id for job_id, job in self.__jobs.items() if job['state'] in FINISHED]
+        for job_id in finished[:max(0, len(finished) - JOB_HISTORY)]:
+            del self.__jobs[job_id]
+
+    def __listen(self):
+        '''Applies the events of the workers to the jobs and replaces workers which died'''
+        while not self.__closed:
+            try:
+                self.__apply(*self.__events.get(timeout=1))
+            except queue.Empty:
+                pass
+            self.__check_workers()
+
+    def __apply(self, job_id: str, event: str, value):
+        with self.__lock:
+            job = self.__jobs.get(job_id)
+            if job is None:
+                return
+            if event == 'running':
+                self.__running[value] = job_id
+                job.update(state='running', started_at=_now())
+            elif event == 'sheet':
+                sheet, state = value
+                job['sheets'][sheet] = state
+            else:
+                self.__running = {pid: i for pid, i in self.__running.items() if i != job_id}
+                self.__finish(job, event, value)
+                logger.info(f'Job {job_id} for {job["shop"]} is {event}')
+
+    def __check_workers(self):
+        dead = [i for i, process in enumerate(self.__workers) if not process.is_alive()]
+        if not dead or self.__closed:
+            return
+
+        # a worker sends everything before it exits, e.g. "done" of its last job before recycling,
+        # so its events are applied first and only a job left running is failed
+        while True:
+            try:
+                self.__apply(*self.__events.get_nowait())
+            except queue.Empty:
+                break
+
+        for i in dead:
+            process = self.__workers[i]
+            if process.exitcode != 0:
+                logger.error(f'Job worker {process.pid} died with code {process.exitcode}')
+            with self.__lock:
+                job = self.__jobs.get(self.__running.pop(process.pid, None))
+                if job and job['state'] == 'running':
+                    self.__finish(job, 'failed', 'The worker process died')
+            self.__workers[i] = self.__start_worker()
+
+
+_queue: JobQueue | None = None
+_queue_lock = threading.Lock()
+
+
+def get_queue() -> JobQueue:
+    '''The job queue of the process, workers are started on first use'''
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue()
+        return _queue
+
+
+def close_queue():
+    global _queue
+    with _queue_lock:
+        if _queue is not None:
+            _queue.close()
+            _queue = None
@@ -0,0 +1,102 @@
+import fcntl
+import json
+import os
+import tempfile
+import threading
+from time import monotonic
+
+# Файл с магазинами и как часто проверять, не изменился ли он (секунды)
+MARKETS_PATH = os.environ.get('MARKETS_PATH', 'markets.json')
+MARKETS_CHECK_INTERVAL = float(os.environ.get('MARKETS_CHECK_INTERVAL', 1))
+
+
+class MarketRegistry:
+    '''Markets of markets.json kept in memory and indexed by name.
+
+    The file is read on first use and again only when its mtime or size changes,
+    which is checked at most once per MARKETS_CHECK_INTERVAL. save() replaces the file
+    atomically under a lock shared by processes. version grows with every change
+    '''
+
+    def __init__(self, path: str = MARKETS_PATH):
+        self.__path = path
+        self.__lock = threading.Lock()
+        self.__markets: dict[str, dict] = {}
+        self.__stat = None
+        self.__checked_at = None
+        self.__version = 0
+
+    @property
+    def version(self) -> int:
+        self.__refresh()
+        return self.__version
+
+    def exists(self) -> bool:
+        self.__refresh()
+        return self.__stat is not None
+
+    def get(self, name: str) -> dict | None:
+        self.__refresh()
+        return self.__markets.get(name)
+
+    def all(self) -> list[dict]:
+        self.__refresh()
+        return list(self.__markets.values())
+
+    def names(self) -> list[str]:
+        self.__refresh()
+        return list(self.__markets)
+
+    def save(self, markets: list[dict]):
+        directory = os.path.dirname(os.path.abspath(self.__path))
+        with self.__lock, open(f'{self.__path}.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                fd, tmp = tempfile.mkstemp(dir=directory, prefix='.markets-', suffix='.json')
+                try:
+                    with os.fdopen(fd, 'w') as f:
+                        json.dump({'markets': markets}, f, ensure_ascii=False)
+                        f.flush()
+                        os.fsync(f.fileno())
+                    os.replace(tmp, self.__path)
+                except BaseException:
+                    if os.path.exists(tmp):
+                        os.remove(tmp)
+                    raise
+                # taken under the lock, a later save by another process must change it
+                stat = self.__file_stat()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+            self.__set(markets, stat)
+
+    def __file_stat(self) -> tuple | None:
+        try:
+            stat = os.stat(self.__path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def __set(self, markets: list[dict], stat: tuple | None):
+        self.__markets = {m['name']: m for m in markets}
+        self.__stat = stat
+        self.__checked_at = monotonic()
+        self.__version += 1
+
+    def __refresh(self):
+        if self.__checked_at is not None and monotonic() - self.__checked_at < MARKETS_CHECK_INTERVAL:
+            return
+
+        with self.__lock:
+            stat = self.__file_stat()
+            if stat == self.__stat:
+                self.__checked_at = monotonic()
+                return
+            if stat is None:
+                self.__set([], None)
+                return
+            with open(self.__path) as f:
+                self.__set(json.load(f)['markets'], stat)
+
+
+registry = MarketRegistry()
@@ -1,13 +1,40 @@
 import requests
 import csv
+import io
+from typing import Callable, Iterator
 from loguru import logger
 import dateutil.parser
-from time import sleep
 from dotenv import load_dotenv
 import os
+import threading
+from src.session import get_session, TIMEOUT
+from src.reports import ReportJobs, ReportError
+from src.pagination import paginate, by_page, by_offset, by_last_id
+from src.cache import DiskCache
+from src.index import index_by
+from src.finance import prepare_order_incomes
+from src.tokens import get_token, invalidate_token
+from src import ratelimit, resilience
+from src.engine import CONCURRENCY
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import timedelta
 
 load_dotenv()
 PROXY= {"https": os.environ.get('ROXY')}
+# Самый длинный период одного отчета статистики Performance API, более длинный делится на части
+ADS_REPORT_MAX_DAYS = int(os.environ.get('ADS_REPORT_MAX_DAYS', 62))
+# Сколько секунд хранить названия складов в кэше
+WAREHOUSE_NAMES_TTL = float(os.environ.get('WAREHOUSE_NAMES_TTL', 7 * 24 * 3600))
+# Товары из кэша каталога: до PRODUCTS_TTL считаются свежими, до PRODUCTS_STALE_TTL отдаются и обновляются в фоне.
+# Остатки (stocks) в кэш не попадают и загружаются заново в каждом прогоне
+PRODUCTS_TTL = float(os.environ.get('PRODUCTS_TTL', 3600))
+PRODUCTS_STALE_TTL = float(os.environ.get('PRODUCTS_STALE_TTL', 6 * 3600))
+# Сколько SKU можно передать в один запрос /v2/product/info/list
+PRODUCT_INFO_CHUNK = 1000
+# Сколько секунд хранить комиссии товаров в кэше
+COMMISSIONS_TTL = float(os.environ.get('COMMISSIONS_TTL', 24 * 3600))
+# Сколько offer_id можно передать в один запрос /v4/product/info/prices
+COMMISSIONS_CHUNK = 1000
 
 
 class Parser:
@@ -22,15 +49,35 @@ class Parser:
     ):
         self.__client_id = client_id
         self.__client_key = client_key
-        self.__beaver_token = None
         self.__date_from = date_from
         self.__date_to = date_to
         self.__perf_client_id = perf_client_id
         self.__perf_client_key = perf_client_key
+        # чьи лимиты запросов расходуются в каждом семействе эндпоинтов
+        self.__rate_accounts = {family: client_id for family in ratelimit.FAMILIES}
+        self.__rate_accounts['performance'] = perf_client_id
 
         # cache
         self.__current_fbo = self.__current_fbs = None
         self.__goods_info = {}
+        # SKU, товары и остатки которых загружены или загружаются в этом прогоне: {sku: Future}
+        self.__goods_loading = {}
+        self.__stocks_loading = {}
+        self.__warehouse_names = DiskCache(f'warehouse_names:{client_id}', WAREHOUSE_NAMES_TTL)
+        self.__catalog = DiskCache(f'products:{client_id}', PRODUCTS_TTL)
+        self.__commissions = DiskCache(f'commissions:{client_id}', COMMISSIONS_TTL)
+
+        # builders may run concurrently in threads, so the cached datasets are fetched under locks
+        self.__postings_locks = {'fbo': threading.Lock(), 'fbs': threading.Lock()}
+        self.__goods_info_lock = threading.Lock()  # only guards the dicts, fetches run without it
+        self.__stock_index = None
+        self.__stock_index_lock = threading.Lock()
+        # requests fanned out by the builders share one pool, so PARSER_CONCURRENCY stays the limit of the run
+        self.__executor = ThreadPoolExecutor(max_workers=CONCURRENCY, thread_name_prefix='ozon')
+
+        # async reports of the run are built by Ozon in parallel and polled together
+        self.__reports = ReportJobs(self.__get_report_file)
+        self.__ads_reports = ReportJobs(self.__get_ads_report_state, delay=2, max_delay=15)
 
         # datetime format dates and parsing period length
         self.__date_from_dt = dateutil.parser.isoparse(self.__date_from) 
@@ -45,59 +92,59 @@ class Parser:
 
     @property
     def beaver_token(self) -> str:
-        if self.__beaver_token is None:
-            headers = {
-                "Content-Type": "application/json",
-                "Accept": "application/json"
-            }
+        return get_token(self.__perf_client_id, self.__request_beaver_token)
 
-            payload = {
-                "client_id": self.__perf_client_id, 
-                "client_secret": self.__perf_client_key, 
-                "grant_type": "client_credentials"
-            }
-            
-            response = self.__p("https://performance.ozon.ru/api/client/token", payload, headers)
-            
-            self.__beaver_token = response.json()['access_token']
+    def __request_beaver_token(self) -> dict:
+        headers = {
+            "Content-Type": "application/json",
+            "Accept": "application/json"
+        }
+
+        payload = {
+            "client_id": self.__perf_client_id, 
+            "client_secret": self.__perf_client_key, 
+            "grant_type": "client_credentials"
+        }
         
-        return self.__beaver_token
+        response = self.__p("https://performance.ozon.ru/api/client/token", payload, headers)
+        return response.json()
 
 
+    def __iter_csv(self, url: str) -> Iterator[list]:
+        '''Yields rows of the csv-file without the header.
+        Rows are parsed while the file is being downloaded, nothing is written to disk
+        '''
+        with self.__g(url, stream=True) as response:
+            response.raw.decode_content = True
+            response.raw.auto_close = False
+            csvfile = io.TextIOWrapper(response.raw, encoding='utf-8-sig', newline='')
+            reader = csv.reader(csvfile, delimiter=";")
+            next(reader, None)
+            yield from reader
+
     def __download_and_get_csv(self, url :str) -> list[list]:
         try:
-            response = self.__g(url)
-            if response.status_code == 200:
-                block_size = 1024  # 1 KB
-                
-                # Open a local file with 'wb' (write binary) mode
-                with open("file.csv", 'wb') as f:
-                    for data in response.iter_content(block_size):
-                        f.write(data)
-            
-            with open('file.csv', newline='', encoding='utf-8') as csvfile:
-                reader = csv.reader(csvfile, delimiter=";")
-                data = list(reader)[1:]
-                
-            return data  # return the rows of csv-file
+            return list(self.__iter_csv(url))  # return the rows of csv-file
         except requests.exceptions.RequestException:
             logger.exception(f"Error downloading file {url}")
             return
 
     def __p(self, url: str, json: dict = None, headers: dict = None) -> requests.Response:
         '''POST'''
-        return self.__r(requests.post, url, json, headers)
+        return self.__r('POST', url, json, headers)
     
-    def __g(self, url: str, json: dict = None, headers: dict = None) -> requests.Response:
+    def __g(self, url: str, json: dict = None, headers: dict = None, stream: bool = False) -> requests.Response:
         '''GET'''
-        return self.__r(requests.get, url, json, headers)
+        return self.__r('GET', url, json, headers, stream)
 
-    def __r(self, method, url: str, json: dict|None = None, headers: dict|None = None) -> requests.Response:
-        '''requests.<method>'''
+    def __r(self, method: str, url: str, json: dict|None = None, headers: dict|None = None, stream: bool = False) -> requests.Response:
+        '''Request through the pooled keep-alive session of the url host'''
+        token = None
         if headers is None:
             if 'performance' in url:
+                token = self.beaver_token
                 headers = {
-                    'Authorization': f'Bearer {self.beaver_token}',
+                    'Authorization': f'Bearer {token}',
                     "Client-Id": self.__perf_client_id,
                     "Api-Key": self.__perf_client_key
                 }
@@ -107,7 +154,32 @@ class Parser:
                     "Api-Key": self.__client_key
                 }
 
-        response = method(url, headers=headers, json=json, proxies=PROXY)
+        family = ratelimit.endpoint_family(url)
+        account = self.__rate_accounts[family] if family else None
+
+        def send() -> requests.Response:
+            for attempt in range(ratelimit.RATE_LIMIT_RETRIES + 1):
+                if family:
+                    ratelimit.acquire(family, account)
+                response = get_session(url).request(
+                    method, url, headers=headers, json=json, proxies=PROXY, timeout=TIMEOUT, stream=stream)
+                if response.status_code != 429 or not family or attempt == ratelimit.RATE_LIMIT_RETRIES:
+                    return response
+
+                # the request waits in the queue of the family instead of failing
+                response.close()
+                delay = ratelimit.retry_after(response, attempt)
+                logger.warning(f'429 from {url}, retrying in {delay:.1f}s')
+                ratelimit.block(family, account, delay)
+
+        response = resilience.call(method, url, send)
+        if response.status_code == 401 and token is not None:
+            # the cached token was revoked or the secret was rotated: one retry with a new token
+            response.close()
+            logger.warning(f'401 from {url}, requesting a new performance token')
+            invalidate_token(self.__perf_client_id, token)
+            headers['Authorization'] = f'Bearer {self.beaver_token}'
+            response = resilience.call(method, url, send)
         try:
             response.raise_for_status()
         except Exception as e:
@@ -127,27 +199,34 @@ class Parser:
 
         return response_json
 
-    def __get_report_url(self, code: str) -> str:
+    def __get_report_file(self, code: str) -> str | None:
         
         payload = {
             "code": code
         }
         
         response = self.__p('https://api-seller.ozon.ru/v1/report/info', payload)
-        
-        if response.status_code == 200:
-            data = response.json()
-            logger.debug(data)
-            url = data['result']['file']
-            status = data['result']['status']
-            if status == 'processing' or status == 'waiting':
-                sleep(3)
-                return self.__get_report_url(code)
-            logger.debug(url)
-            return url
-            
-        
-    def create_products_report(self) -> list[list]:
+        data = response.json()
+        logger.debug(data)
+        status = data['result']['status']
+        if status == 'failed':
+            raise ReportError(f"Report {code} failed: {data['result']['error']}")
+        if status != 'success':
+            return None
+        return data['result']['file']
+
+    def close(self):
+        '''Stops the threads of the parser, it must not be used after'''
+        self.__executor.shutdown(wait=False, cancel_futures=True)
+
+    def start_reports(self):
+        '''Submits every async report of the run at once, so Ozon builds them in parallel'''
+        self.__reports.submit('products', self.__create_products_report_job)
+        for scope_type in ('fbo', 'fbs'):
+            self.__reports.submit(f'postings_{scope_type}', lambda s=scope_type: self.__create_postings_report_job(s))
+        self.__submit_ads_reports()
+
+    def __create_products_report_job(self) -> str:
         payload = {
             "language": "DEFAULT",
             "offer_id": [ ],
@@ -157,17 +236,16 @@ class Parser:
         }
 
         response = self.__p("https://api-seller.ozon.ru/v1/report/products/create", payload)
+        return response.json()['result']['code']
 
-        if response.status_code == 200:
-            data = response.json()
-            code = data['result']['code']
-            url = self.__get_report_url(code)
-            result = self.__download_and_get_csv(url)
-            return [i[:16] for i in result]
-        else:
+    def create_products_report(self) -> list[list]:
+        url = self.__reports.result('products', self.__create_products_report_job)
+        if not url:
             logger.warning('Product report creating was failed')
             return -1
 
+        return [i[:16] for i in self.__iter_csv(url)]
+
     def __prepare_return_report(self, data: list[dict], scope_type: str) -> list[list]:
         
         result = []
@@ -176,28 +254,14 @@ class Parser:
         if not skus:
             return result
         
-        payload = {
-            "offer_id": [],
-            "product_id": [],
-            "sku": skus
-        }
-        
-        product_response = self.__p(
-            'https://api-seller.ozon.ru/v2/product/info/list', 
-            payload
-
-        )
-        product_response = product_response.json()
-        if not product_response:
-            product_list = []
-        else:
-            product_list = product_response['result']['items']
+        # products come from the shared catalog, so names are looked up by sku in a dict
+        goods_info = self.__getGoodsInfo(skus)
         
         def get_name_by_sku(sku):
-            for elem in product_list:
-                if elem['sku'] == item['sku']:
-                    return elem['name']
+            info = goods_info.get(sku)
+            if not info or info['offer_id'] == 'Нет данных':
                 return "Имя отсутствует, товар удален"
+            return info['name']
         
         for item in data:
             
@@ -217,33 +281,34 @@ class Parser:
 
     # scope_type - fbo | fbs
     def create_returns_report(self, scope_type: str) -> list[list]:
-        payload = {
-            "filter": {} if scope_type != 'fbs' else {
-                "last_free_waiting_day": {
-                    "time_from": self.__date_from,
-                    "time_to": self.__date_to
-                }
-            },
-            "last_id": 0,
-            "limit": 1000
-        }
-        
-        response = self.__p(f"https://api-seller.ozon.ru/v3/returns/company/{scope_type}", payload)
-        
-        if response.status_code == 200:
-            data = response.json()['returns']
-            if not data:
-                return []
-        
-            return self.__prepare_return_report(data, scope_type)
+        def fetch(last_id: int, limit: int) -> tuple[list, int]:
+            payload = {
+                "filter": {} if scope_type != 'fbs' else {
+                    "last_free_waiting_day": {
+                        "time_from": self.__date_from,
+                        "time_to": self.__date_to
+                    }
+                },
+                "last_id": last_id,
+                "limit": limit
+            }
+            
+            response = self.__p(f"https://api-seller.ozon.ru/v3/returns/company/{scope_type}", payload)
+            data = self.__find_keys(response.json(), 'returns')
+            return data, (data[-1]['id'] if data else None)
+
+        result = []
+        for data in by_last_id(fetch, 1000):
+            result += self.__prepare_return_report(data, scope_type)
         
+        return result
+
 
     def create_postings_report(self, scope_type: str) -> list[list]:
-        if scope_type == 'fbs' and self.__current_fbs is not None:
-            return self.__current_fbs
-        if scope_type == 'fbo' and self.__current_fbo is not None:
-            return self.__current_fbo
+        with self.__postings_locks[scope_type]:
+            return self.__create_postings_report(scope_type)
 
+    def __create_postings_report_job(self, scope_type: str) -> str | None:
         payload = {
             "filter": {
                 "processed_at_from": self.__date_from,
@@ -256,11 +321,20 @@ class Parser:
         response = self.__p('https://api-seller.ozon.ru/v1/report/postings/create', payload)
         response = response.json()
         if not response:
-            return []
-        
-        code = response['result']['code']
+            return None
         
-        url = self.__get_report_url(code)
+        return response['result']['code']
+
+    def __create_postings_report(self, scope_type: str) -> list[list]:
+        if scope_type == 'fbs' and self.__current_fbs is not None:
+            return self.__current_fbs
+        if scope_type == 'fbo' and self.__current_fbo is not None:
+            return self.__current_fbo
+
+        url = self.__reports.result(f'postings_{scope_type}', lambda: self.__create_postings_report_job(scope_type))
+        if not url:
+            return []
+
         res =  self.__download_and_get_csv(url)
 
         if scope_type == 'fbo':
@@ -270,20 +344,27 @@ class Parser:
 
         return res
 
-    def create_supply_orders_report(self) -> list[list]:
+    def __get_supply_order_list(self, page: int, page_size: int, states: list[str] | None = None) -> list[dict]:
         payload = {
-            "page": 1,
-            "page_size": 100
+            "page": page,
+            "page_size": page_size
         }
+        if states is not None:
+            payload["states"] = states
         
         response = self.__p(
             'https://api-seller.ozon.ru/v1/supply-order/list', 
             payload
         )
         
-        data = response.json()['supply_orders']
+        return self.__find_keys(response.json(), 'supply_orders')
+
+    def create_supply_orders_report(self) -> list[list]:
+        result = []
+        for data in by_page(self.__get_supply_order_list, 100):
+            result += self.__prepare_orders_report(data)
         
-        return self.__prepare_orders_report(data)
+        return result
 
     def __prepare_orders_report(self, data: list[dict]) -> list[list]:
 
@@ -322,18 +403,55 @@ class Parser:
 
         return left
 
-    def __get_ads_report(self) -> list[list]:
-        
+    def __ads_report_periods(self) -> list[tuple[str, str]]:
+        if (self.__date_to_dt.date() - self.__date_from_dt.date()).days < ADS_REPORT_MAX_DAYS:
+            return [(self.__date_from, self.__date_to)]
+
+        # the report takes whole days, so a chunk starts the day after the previous one ends
+        periods = []
+        start = self.__date_from_dt
+        while start.date() <= self.__date_to_dt.date():
+            end = min(start + timedelta(days=ADS_REPORT_MAX_DAYS - 1), self.__date_to_dt)
+            periods.append((start.isoformat(), end.isoformat()))
+            start = (end + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+        return periods
+
+    def __submit_ads_reports(self) -> list:
+        '''Submits statistics reports for every period chunk at once'''
+        futures = []
+        for date_from, date_to in self.__ads_report_periods():
+            futures.append(self.__ads_reports.submit(
+                f'ads_{date_from}_{date_to}',
+                lambda f=date_from, t=date_to: self.__create_ads_report_job(f, t)
+            ))
+        return futures
+
+    def __create_ads_report_job(self, date_from: str, date_to: str) -> str:
         payload = {
-            "from": f"{self.__date_from}",
-            "to": f"{self.__date_to}"
+            "from": date_from,
+            "to": date_to
         }
 
         response = self.__p( 
             'https://performance.ozon.ru:443/api/client/statistic/products/generate/json', 
             payload
         )
-        data = self.__prepare_ads_report(response.json())
+        return response.json()['UUID']
+
+    def __get_ads_report_state(self, uuid: str) -> str | None:
+        response = self.__g(f'https://performance.ozon.ru/api/client/statistics/{uuid}')
+        data = response.json()
+        state = data.get('state')
+        if state == 'ERROR':
+            raise ReportError(f"Statistics report {uuid} failed: {data.get('error')}")
+        if state != 'OK':
+            return None
+        return uuid
+
+    def __get_ads_report(self) -> list[list]:
+        
+        chunks = [self.__prepare_ads_report(future.result()) for future in self.__submit_ads_reports()]
+        data = chunks[0] if len(chunks) == 1 else self.__merge_ads_reports(chunks)
         
         result = []
         for item in data:
@@ -351,11 +469,32 @@ class Parser:
         
         return result
 
-    def __prepare_ads_report(self, data: dict) -> list[list]:
-        
-        uuid = data['UUID']
-        
-        sleep(5)
+    def __merge_ads_reports(self, chunks: list[list[dict]]) -> list[dict]:
+        '''One row per SKU for a period split into chunks: the totals are summed and drr is
+        computed again from them, the bid is the one of the latest chunk
+        '''
+        merged = {}
+        for item in (item for chunk in chunks for item in chunk):
+            if item['sku'] not in merged:
+                merged[item['sku']] = dict(item, orders=0, ordersMoney=0, moneySpent=0)
+            row = merged[item['sku']]
+            for field in ('orders', 'ordersMoney', 'moneySpent'):
+                row[field] += self.__to_number(item[field])
+            row['bid'] = item['bid']
+
+        for row in merged.values():
+            row['orders'] = int(row['orders'])
+            row['drr'] = round(row['moneySpent'] / row['ordersMoney'] * 100, 2) if row['ordersMoney'] else '-'
+        return list(merged.values())
+
+    @staticmethod
+    def __to_number(value) -> float:
+        # the report gives numbers as strings with a decimal comma, e.g. "1 234,50"
+        if isinstance(value, str):
+            value = value.replace('\xa0', '').replace(' ', '').replace(',', '.')
+        return float(value or 0)
+
+    def __prepare_ads_report(self, uuid: str) -> list[list]:
         
         report_response = self.__g(f'https://performance.ozon.ru/api/client/statistics/report?UUID={uuid}')
         return report_response.json()['report']['rows']
@@ -388,45 +527,59 @@ class Parser:
         return result
 
     def __get_stock_on_warehouses(self):
-        json = {
-            "limit": 100,
-            "offset": 0,
-            "warehouse_type": "ALL"
-        }
+        def fetch(offset: int, limit: int) -> list:
+            json = {
+                "limit": limit,
+                "offset": offset,
+                "warehouse_type": "ALL"
+            }
 
-        response = self.__p('https://api-seller.ozon.ru/v2/analytics/stock_on_warehouses', json)
-        response = self.__find_keys(response.json(), 'result', 'rows')
-        if not response:
-            return []
-        
-        return response
+            response = self.__p('https://api-seller.ozon.ru/v2/analytics/stock_on_warehouses', json)
+            return self.__find_keys(response.json(), 'result', 'rows')
+
+        return [row for rows in by_offset(fetch, 1000) for row in rows]
+
+    def __get_stock_index(self) -> dict:
+        '''{sku: free_to_sell_amount} built once per run and shared by the builders'''
+        with self.__stock_index_lock:
+            if self.__stock_index is None:
+                self.__stock_index = index_by(
+                    self.__get_stock_on_warehouses(),
+                    lambda row: int(row['sku']),
+                    lambda row: row['free_to_sell_amount']
+                )
+            return self.__stock_index
 
     def get_order_incomes(self):
-        json = {
-            'filter': {
-                "transaction_type": "all",
-                'date': {
-                    'from': self.__date_from,
-                    'to': self.__date_to
+        def fetch(page: int) -> tuple[list, int | None]:
+            json = {
+                'filter': {
+                    "transaction_type": "all",
+                    'date': {
+                        'from': self.__date_from,
+                        'to': self.__date_to
+                    },
+                    "operation_type": [],
+                    "posting_number": "",
                 },
-                "operation_type": [],
-                "posting_number": "",
-            },
-            "page": 1,
-            "page_size": 1000
-        }
+                "page": page,
+                "page_size": 1000
+            }
 
-        response = self.__p('https://api-seller.ozon.ru/v3/finance/transaction/list', json)
-        response = self.__find_keys(response.json(), 'result', 'operations')
-        if not response:
-            return []
+            response = self.__p('https://api-seller.ozon.ru/v3/finance/transaction/list', json)
+            response = self.__find_keys(response.json(), 'result')
+            if not response:
+                return [], None
+            return response.get('operations', []), (page + 1 if page < response.get('page_count', 0) else None)
+
+        result = []
+        for operations in paginate(fetch, 1):
+            result += self.__prepare_order_incomes(operations)
         
-        return self.__prepare_order_incomes(response)
+        return result
 
     
     def __prepare_order_incomes(self, data: list[dict]) -> list:
-        result = []
-
         warehouse_names = self.__getWareHouseNames([i['posting']['warehouse_id'] for i in data])
         goods = set()
         for i in data:
@@ -434,50 +587,21 @@ class Parser:
                 goods.add(g['sku'])
         good_info = self.__getGoodsInfo(list(goods))
 
-        def getServicePrice(name: str, item: dict) -> float:
-            for i in item['services']:
-                if name in i:
-                    return i[name]['price']
-            return 0
-
-        for item in data:
-            item['services_str'] = str(item['services'])
-            goods_num = len(item['items'])
-            for good in item['items']:
-                row = [
-                    item['operation_date'],
-                    item['operation_type_name'],
-                    item['operation_id'],
-                    item['posting']['order_date'],
-                    warehouse_names[item['posting']['warehouse_id']],
-                    item['operation_date'],
-                    good['sku'],
-                    good_info[good['sku']]['offer_id'],
-                    good_info[good['sku']]['name'],
-                    1,
-                    self.__cnvBool('MarketplaceNotDeliveredCostItem' in item['services_str'] or 'MarketplaceReturnAfterDeliveryCostItem' in item['services_str']),
-                    item['sale_commission'],
-                    item['posting']['posting_number'],
-                    'Pick-Up' if 'MarketplaceServiceItemPickup' in item['services_str'] else (
-                        'Drop-off' if 'MarketplaceServiceItemDropoffPPZ' in item['services_str'] else 'Нет данных'),
-                    self.__cnvBool(getServicePrice('MarketplaceServiceItemDirectFlowTrans', item) / goods_num, True),
-                    self.__cnvBool(getServicePrice('MarketplaceServiceItemDelivToCustomer', item) / goods_num, True),
-                    self.__cnvBool(getServicePrice('MarketplaceServiceItemReturnFlowTrans', item) / goods_num, True),
-                    self.__cnvBool('MarketplaceServiceItemReturnAfterDelivToCustomer' in item['services_str']),
-                    self.__cnvBool('MarketplaceServiceItemReturnNotDelivToCustomer' in item['services_str']),
-                    self.__cnvBool('MarketplaceServiceItemReturnPartGoodsCustomer' in item['services_str']),
-                    self.__cnvBool('MarketplaceServiceItemDirectFlowLogistic' in item['services_str']),
-                    'Нет данных',
-                    self.__cnvBool('MarketplaceServiceItemReturnFlowLogistic' in item['services_str']),
-                    item['amount'] / goods_num
-                ]
-                result.append(row)
-            
-        return result
+        return prepare_order_incomes(data, warehouse_names, good_info)
 
     def __getWareHouseNames(self, warehouse_ids: list[str]) -> dict:
-    
-        return {i: self.__get_wh_name(i) for i in warehouse_ids}       
+        warehouse_ids = set(warehouse_ids)
+        cached = self.__warehouse_names.get_many(list(warehouse_ids))
+        names = {i: cached[str(i)] for i in warehouse_ids if str(i) in cached}
+
+        missing = [i for i in warehouse_ids if i not in names]
+        if missing:
+            fetched = dict(zip(missing, self.__executor.map(self.__get_wh_name, missing)))
+            # a missing name may be a transient answer, so only real names are cached
+            self.__warehouse_names.set_many({i: name for i, name in fetched.items() if name != 'Нет данных'})
+            names.update(fetched)
+
+        return names
     
     def __get_wh_name(self, wh_id: int) -> str:
         json = {
@@ -496,40 +620,83 @@ class Parser:
 
         return res[0]['name']
 
-    def __getGoodsInfo(self, good_skus: list[str]) -> dict:
-        good_skus = list(set(good_skus) - set(self.__goods_info.keys()))
-
-        if not good_skus:
+    def __getGoodsInfo(self, good_skus: list[str], stocks: bool = False) -> dict:
+        '''Product info by sku. Stocks are only guaranteed with stocks=True,
+        they are never taken from the catalog cache
+        '''
+        self.__loadOnce(good_skus, self.__goods_loading, self.__fetchGoodsInfo)
+        if stocks:
+            self.__loadOnce(good_skus, self.__stocks_loading, self.__fetchStocks)
+        with self.__goods_info_lock:
             return self.__goods_info.copy()
-        
-        payload = {
-            "offer_id": [],
-            "product_id": [],
-            "sku": good_skus
-        }
-        products = self.__p(
-            'https://api-seller.ozon.ru/v2/product/info/list', 
-            payload
-        )
-        products = self.__find_keys(products.json(), 'result', 'items')
-        if not products:
-            return self.__goods_info
-        
-        commissions = self.__getGoodCommissions([i['offer_id'] for i in products])
-        for p in products:
-            self.__goods_info[p['sku']] = {
-                'is_kgt': p['is_kgt'],
-                'currency_code': p['currency_code'],
-                'offer_id': p['offer_id'],         
-                'name': p['name'],
-                "price_indexes": p['price_indexes'],
-                'commissions': {'value': 'Нет данных'} if not commissions else {'value': commissions[p['offer_id']]},
-                'stocks': p['stocks']
-            }
-        
-        for s in good_skus:
-            if s not in self.__goods_info:
-                self.__goods_info[p['sku']] = {
+
+    def __loadOnce(self, good_skus: list, loading: dict, load: Callable[[list], None]):
+        '''Calls load() for the skus nobody has loaded yet and waits for the skus other
+        builders are loading at the moment, so every sku is fetched once per run
+        '''
+        future = Future()
+        with self.__goods_info_lock:
+            others = {loading[s] for s in set(good_skus) if s in loading}
+            own = [s for s in set(good_skus) if s not in loading]
+            for s in own:
+                loading[s] = future
+
+        if own:
+            try:
+                load(own)
+            except BaseException as e:
+                # the next call loads them again
+                with self.__goods_info_lock:
+                    for s in own:
+                        del loading[s]
+                future.set_exception(e)
+                raise
+            future.set_result(None)
+
+        for other in others:
+            other.result()
+
+    def __fetchStocks(self, good_skus: list):
+        fetched = self.__loadGoodsInfo(good_skus)
+        with self.__goods_info_lock:
+            for s in good_skus:
+                if s in fetched:
+                    self.__goods_info[s]['stocks'] = fetched[s]['stocks']
+                else:
+                    self.__goods_info[s].setdefault('stocks', {
+                        "coming": 'Нет данных',
+                        "present": 'Нет данных',
+                        "reserved": 'Нет данных'
+                    })
+
+    def __fetchGoodsInfo(self, good_skus: list[str]):
+        goods_info = {}
+
+        # fresh products are taken from the catalog cache, stale ones are returned
+        # as they are and refreshed in the background
+        stale = []
+        for sku, (info, age) in self.__catalog.get_entries(good_skus).items():
+            if age < PRODUCTS_STALE_TTL:
+                sku = int(sku) if sku.isdigit() else sku
+                goods_info[sku] = info
+                if age >= PRODUCTS_TTL:
+                    stale.append(sku)
+        if stale:
+            threading.Thread(target=self.__loadGoodsInfo, args=(stale,), daemon=True).start()
+
+        missing = [s for s in good_skus if s not in goods_info]
+        if missing:
+            goods_info.update(self.__loadGoodsInfo(missing))
+
+        # commissions have their own cache and are refreshed independently of product info
+        found = [goods_info[s] for s in good_skus if s in goods_info]
+        commissions = self.__getGoodCommissions([i['offer_id'] for i in found])
+        for i in found:
+            i['commissions'] = {'value': commissions.get(i['offer_id'], 'Нет данных')}
+        
+        for s in missing:
+            if s not in goods_info:
+                goods_info[s] = {
                     'is_kgt': 'Нет данных',
                     'currency_code': 'Нет данных',
                     'offer_id': 'Нет данных',         
@@ -545,50 +712,97 @@ class Parser:
                     } 
                 }
 
-        return self.__goods_info.copy()
+        with self.__goods_info_lock:
+            self.__goods_info.update(goods_info)
+            # downloaded info comes with fresh stocks
+            loaded = Future()
+            loaded.set_result(None)
+            for s in missing:
+                self.__stocks_loading.setdefault(s, loaded)
+
+    def __loadGoodsInfo(self, good_skus: list) -> dict:
+        '''Downloads product info in API sized chunks and puts it without stocks into the catalog cache'''
+        def fetch(skus: list) -> list:
+            payload = {
+                "offer_id": [],
+                "product_id": [],
+                "sku": skus
+            }
+            products = self.__p(
+                'https://api-seller.ozon.ru/v2/product/info/list', 
+                payload
+            )
+            return self.__find_keys(products.json(), 'result', 'items')
+
+        chunks = [good_skus[i:i + PRODUCT_INFO_CHUNK] for i in range(0, len(good_skus), PRODUCT_INFO_CHUNK)]
+        products = [p for chunk in self.__executor.map(fetch, chunks) for p in chunk]
+        if not products:
+            return {}
+
+        goods_info = {}
+        for p in products:
+            goods_info[p['sku']] = {
+                'is_kgt': p['is_kgt'],
+                'currency_code': p['currency_code'],
+                'offer_id': p['offer_id'],         
+                'name': p['name'],
+                "price_indexes": p['price_indexes'],
+                'stocks': p['stocks']
+            }
+
+        self.__catalog.set_many({
+            sku: {k: v for k, v in info.items() if k != 'stocks'} for sku, info in goods_info.items()
+        })
+        return goods_info
 
     def __getGoodCommissions(self, offer_id: list[str]) -> dict:
-        try:
+        offer_id = list(set(offer_id))
+        result = self.__commissions.get_many(offer_id)
+
+        missing = [i for i in offer_id if i not in result]
+        if missing:
+            chunks = [missing[i:i + COMMISSIONS_CHUNK] for i in range(0, len(missing), COMMISSIONS_CHUNK)]
+            fetched = {}
+            for chunk in self.__executor.map(self.__fetchGoodCommissions, chunks):
+                fetched.update(chunk)
+            self.__commissions.set_many(fetched)
+            result.update(fetched)
+
+        return result
+
+    def __fetchGoodCommissions(self, offer_id: list[str]) -> dict:
+        def fetch(last_id: str, limit: int) -> tuple[list, str]:
             info = self.__p('https://api-seller.ozon.ru/v4/product/info/prices', {
-                "last_id": "",
-                "limit": 100,
+                "last_id": last_id,
+                "limit": limit,
                 "filter": {
                     "offer_id": offer_id,
                     "product_id": [],
                     "visibility": "ALL"
                 }
             })
-        except:
-            return {}
-        
-        res = self.__find_keys(info.json()['result'], 'items')
-        if not res:
-            return {}
-        
+            res = self.__find_keys(info.json(), 'result')
+            return res.get('items', []), res.get('last_id')
+
         result = {}
-        for r in res:
-            result[r['offer_id']] = sum(list(r['commissions'].values()))
+        try:
+            for res in by_last_id(fetch, COMMISSIONS_CHUNK, ''):
+                for r in res:
+                    result[r['offer_id']] = sum(list(r['commissions'].values()))
+        except:
+            logger.exception('Failed to get commissions')
 
         return result
 
-    def __cnvBool(self, s: bool|object, value_if_true: bool = False) -> str|object:
-        if s:
-            if not value_if_true:
-                return '+'
-            return s
-        return '-'
-    
-    def create_supply_report(self):
-        goods = self.create_postings_report('fbo') + self.create_postings_report('fbs')
+    def create_supply_report(self, goods: list[list] | None = None):
+        if goods is None:
+            goods = self.create_postings_report('fbo') + self.create_postings_report('fbs')
         if not goods:
             return []
-        whs_stocks = self.__get_stock_on_warehouses()
+        stock_index = self.__get_stock_index()
 
         def get_stock(sku: int):
-            for i in whs_stocks:
-                if int(i['sku']) == sku:
-                    return i['free_to_sell_amount']
-            return 'Нет данных'
+            return stock_index.get(sku, 'Нет данных')
 
         info = self.__getGoodsInfo([int(i[10]) for i in goods])
         res = {}
@@ -624,26 +838,19 @@ class Parser:
         return list(res.values())
 
     def get_products_awailability(self):
-        payload = {
-            "page": 1,
-            "page_size": 100,
-            "states": ['READY_TO_SUPPLY', 'ACCEPTED_AT_SUPPLY_WAREHOUSE', 'IN_TRANSIT', 'COMPLETED']
-        }
-        supplies = self.__p(
-            'https://api-seller.ozon.ru/v1/supply-order/list', 
-            payload
-        )
-        supplies = self.__find_keys(supplies.json(), 'supply_orders')
+        states = ['READY_TO_SUPPLY', 'ACCEPTED_AT_SUPPLY_WAREHOUSE', 'IN_TRANSIT', 'COMPLETED']
+        supplies = [
+            s for page in by_page(lambda page, page_size: self.__get_supply_order_list(page, page_size, states), 100)
+            for s in page
+        ]
         if not supplies:
             return []
-        
-        payload["supply_order_id"] = None
 
         goods_supply_num = {}
         supplie_order_states = {}
 
         for s in supplies:
-            items = self.__get_supply_orders(s['supply_order_id'], payload)
+            items = self.__get_supply_orders(s['supply_order_id'])
             if not items:
                 continue
             for i in items:
@@ -655,7 +862,7 @@ class Parser:
         if not goods_supply_num:
             return []
 
-        info = self.__getGoodsInfo(list(goods_supply_num.keys()))
+        info = self.__getGoodsInfo(list(goods_supply_num.keys()), stocks=True)
 
         result = {}
         for g in goods_supply_num:
@@ -688,42 +895,46 @@ class Parser:
         return list(result.values())
 
 
-    def __get_supply_orders(self, supply_order_id: int, json: dict) -> list:
-        json['supply_order_id'] = int(supply_order_id)
-        try:
+    def __get_supply_orders(self, supply_order_id: int) -> list:
+        def fetch(page: int, page_size: int) -> list:
+            json = {
+                "page": page,
+                "page_size": page_size,
+                "supply_order_id": int(supply_order_id)
+            }
             products = self.__p(
                 'https://api-seller.ozon.ru/v1/supply-order/items', 
                 json
             )
+            return self.__find_keys(products.json(), 'items')
+
+        try:
+            return [p for page in by_page(fetch, 100) for p in page]
         except:
             return []
-        
-        products = self.__find_keys(products.json(), 'items')
-        if not products:
-            return []
-        
-        return products
 
 
     def create_supply_await_report(self):
-        payload = {
-            "offset": 0,
-            "limit": 1000,
-            "date_from": self.__date_from_truncated,
-            "date_to": self.__date_to_truncated, 
-            "metrics": ['revenue', 'ordered_units'],
-            "dimensions": ["sku"]
-        }
-        supplies = self.__p(
-            'https://api-seller.ozon.ru/v1/analytics/data', 
-            payload
-        )
+        def fetch(offset: int, limit: int) -> list:
+            payload = {
+                "offset": offset,
+                "limit": limit,
+                "date_from": self.__date_from_truncated,
+                "date_to": self.__date_to_truncated, 
+                "metrics": ['revenue', 'ordered_units'],
+                "dimensions": ["sku"]
+            }
+            supplies = self.__p(
+                'https://api-seller.ozon.ru/v1/analytics/data', 
+                payload
+            )
+            return self.__find_keys(supplies.json(), 'result', 'data')
 
-        supplies = self.__find_keys(supplies.json(), 'result', 'data')
+        supplies = [s for page in by_offset(fetch, 1000) for s in page]
         if not supplies:
             return []
         
-        g_info = self.__getGoodsInfo([int(s['dimensions'][0]['id']) for s in supplies])
+        g_info = self.__getGoodsInfo([int(s['dimensions'][0]['id']) for s in supplies], stocks=True)
         result = {}
         for s in supplies:
             sku = s['dimensions'][0]['id']
@@ -0,0 +1,47 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, TypeVar
+
+Cursor = TypeVar('Cursor')
+
+
+def paginate(fetch: Callable[[Cursor], tuple[list, Cursor | None]], cursor: Cursor) -> Iterator[list]:
+    '''Yields pages of a list endpoint one by one.
+
+    fetch(cursor) returns the items of the page and the cursor of the next one
+    (None for the last page). The next page is requested in the background
+    while the caller is working with the current one.
+    '''
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(fetch, cursor)
+        while future is not None:
+            items, cursor = future.result()
+            future = executor.submit(fetch, cursor) if cursor is not None else None
+            if items:
+                yield items
+
+
+def by_page(fetch: Callable[[int, int], list], page_size: int, first_page: int = 1) -> Iterator[list]:
+    '''page/page_size endpoints. The page is the last one when it is not full'''
+    def page(number: int) -> tuple[list, int | None]:
+        items = fetch(number, page_size)
+        return items, (number + 1 if len(items) >= page_size else None)
+
+    return paginate(page, first_page)
+
+
+def by_offset(fetch: Callable[[int, int], list], limit: int) -> Iterator[list]:
+    '''offset/limit endpoints. The page is the last one when it is not full'''
+    def page(offset: int) -> tuple[list, int | None]:
+        items = fetch(offset, limit)
+        return items, (offset + limit if len(items) >= limit else None)
+
+    return paginate(page, 0)
+
+
+def by_last_id(fetch: Callable[[object, int], tuple[list, object]], limit: int, first_id: object = 0) -> Iterator[list]:
+    '''last_id/limit endpoints. fetch returns the items and the last_id of the page'''
+    def page(last_id: object) -> tuple[list, object | None]:
+        items, next_id = fetch(last_id, limit)
+        return items, (next_id if len(items) >= limit else None)
+
+    return paginate(page, first_id)
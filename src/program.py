@@ -1,58 +1,22 @@
 from src.ozon import Parser as OzonParser
 from src.wildberries import Parser as WildberriesParser
-from src.g_functions import GSheet
+from src.sinks import Sink, create_sink
+from src.engine import AsyncParser, concat
+from src.scheduler import Scheduler
+from src import resilience
 from loguru import logger
 import dateutil.parser
 from multiprocessing import Process
+import asyncio
+from typing import Callable
 
 def run(marketplace, spreadsheet_url, performance_key, performance_secret, client_id, client_key, startDate, endDate,
-        background_tasks = None) -> str:
-
-    try:
-        spreadsheet = GSheet.create(
-            spreadsheet_url,
-            dateutil.parser.isoparse(startDate),
-            dateutil.parser.isoparse(endDate) 
-        )
-        parser = (OzonParser if marketplace.lower() == 'ozon' else  WildberriesParser)(
-            client_id, client_key, startDate, endDate, performance_key, performance_secret)
-    except:
-        logger.exception('Failed to get parser and spreadsheet:')
+        background_tasks = None, sink: str = 'gsheet', sink_path: str | None = None, shop_name: str | None = None) -> str:
 
     def work():
         try:
-            execute_statistics_parsing(spreadsheet, {
-                "Реклама": {
-                    "GetData": parser.create_ads_report
-                },
-                "Расчет поставок": {
-                    "GetData": parser.create_supply_await_report
-                },
-                "Индекс локализации": {
-                    "GetData": parser.create_index_localizatioons
-                },
-                "Размещение": {
-                    "GetData": parser.create_supply_report
-                },
-                "Продажи": {
-                    "GetData": lambda: parser.create_postings_report('fbo') + parser.create_postings_report('fbs'),
-                },
-                "Доступность товаров": {
-                    "GetData": parser.get_products_awailability
-                },
-                "Начисления по товарам":{
-                    "GetData": parser.get_order_incomes
-                },
-                "Товары":{
-                    "GetData": parser.create_products_report,
-                },
-                "Возвраты": {
-                    "GetData": lambda: parser.create_returns_report('fbo') + parser.create_returns_report('fbs')
-                },
-                "Заявки на поставку": {
-                    "GetData": parser.create_supply_orders_report
-                },
-            })
+            execute(marketplace, spreadsheet_url, performance_key, performance_secret, client_id, client_key,
+                    startDate, endDate, sink, sink_path, shop_name)
         except:
             logger.exception('Failed to run program:')
 
@@ -67,31 +31,128 @@ def run(marketplace, spreadsheet_url, performance_key, performance_secret, clien
 
     return spreadsheet_url
 
-def execute_statistics_parsing(spreadsheet: GSheet, callbacks: dict):
+def execute(marketplace, spreadsheet_url, performance_key, performance_secret, client_id, client_key, startDate, endDate,
+            sink: str = 'gsheet', sink_path: str | None = None, shop_name: str | None = None,
+            progress: Callable[[str, str], None] | None = None):
+    '''Runs the sync in the current process. progress(sheet_name, state) is called as sheets go
+    through "pending", "ready", "no data", "failed" and "saved"
+    '''
+    spreadsheet = create_sink(
+        sink,
+        dateutil.parser.isoparse(startDate),
+        dateutil.parser.isoparse(endDate),
+        spreadsheet_url=spreadsheet_url,
+        path=sink_path,
+        shop=shop_name or client_id
+    )
+    parser = (OzonParser if marketplace.lower() == 'ozon' else  WildberriesParser)(
+        client_id, client_key, startDate, endDate, performance_key, performance_secret)
+
+    try:
+        parser.start_reports()
+        aparser = AsyncParser(parser)
+        execute_statistics_parsing(spreadsheet, {
+            "Реклама": {
+                "GetData": aparser.create_ads_report
+            },
+            "Расчет поставок": {
+                "GetData": aparser.create_supply_await_report
+            },
+            "Индекс локализации": {
+                "GetData": aparser.create_index_localizatioons
+            },
+            "Размещение": {
+                "GetData": lambda fbo, fbs: aparser.create_supply_report((fbo or []) + (fbs or [])),
+                "Needs": ["postings_fbo", "postings_fbs"]
+            },
+            "Продажи": {
+                "GetData": lambda fbo, fbs: (fbo or []) + (fbs or []),
+                "Needs": ["postings_fbo", "postings_fbs"]
+            },
+            "Доступность товаров": {
+                "GetData": aparser.get_products_awailability
+            },
+            "Начисления по товарам":{
+                "GetData": aparser.get_order_incomes
+            },
+            "Товары":{
+                "GetData": aparser.create_products_report,
+            },
+            "Возвраты": {
+                "GetData": lambda: concat(aparser.create_returns_report('fbo'), aparser.create_returns_report('fbs'))
+            },
+            "Заявки на поставку": {
+                "GetData": aparser.create_supply_orders_report
+            },
+        }, {
+            "postings_fbo": {
+                "GetData": lambda: aparser.create_postings_report('fbo')
+            },
+            "postings_fbs": {
+                "GetData": lambda: aparser.create_postings_report('fbs')
+            },
+        }, progress, aparser.semaphore)
+    finally:
+        parser.close()
+        if resilience.counters():
+            logger.info(f'HTTP retries and circuit breakers: {resilience.counters()}')
+
+def execute_statistics_parsing(spreadsheet: Sink, callbacks: dict, datasets: dict | None = None,
+                               progress: Callable[[str, str], None] | None = None,
+                               semaphore: asyncio.Semaphore | None = None):
     '''The func goes through callbacks dict which includes:
         {
             "SheetName": {
-                "GetData": function (required)
+                "GetData": function or coroutine function (required),
+                "Needs": ["dataset_name", ...] (optional),
+                "Blocking": True (optional, for a GetData which blocks instead of returning an awaitable)
             }
         }
-        And executes them
+        datasets dict has the same form and describes data shared by several sheets.
+        Every GetData gets the results of its "Needs" as args.
+        Sheets are executed concurrently, their rows are buffered as soon as they are ready
+        and written to the sink (a spreadsheet by default) in one batch at the end.
+        progress(sheet_name, state) gets the state of every sheet. semaphore is the concurrency
+        limit shared with the parser, e.g. AsyncParser.semaphore
     '''
-    for sheet_name in callbacks:
-        try:
-            data = callbacks[sheet_name]["GetData"]()
-        except Exception as e:
-            logger.exception(f'Failed to parse {sheet_name}')
-            data = None
+    states = {name: 'pending' for name in callbacks}
+
+    def report(sheet_name: str, state: str):
+        states[sheet_name] = state
+        if progress:
+            progress(sheet_name, state)
+
+    for name in callbacks:
+        report(name, 'pending')
+
+    def save(sheet_name: str, data: list | None):
         if data:
             try:
                 spreadsheet.put_data_in_ws(data, sheet_name)
             except Exception as e:
                 logger.exception(f'Failed to save {sheet_name}')
+                report(sheet_name, 'failed')
             else:
-                logger.info(f'{sheet_name} saved')
+                logger.info(f'{sheet_name} is ready')
+                report(sheet_name, 'ready')
         else:
             logger.info(f'No data for {sheet_name}')
+            if states[sheet_name] != 'failed':
+                report(sheet_name, 'no data')
 
+    try:
+        asyncio.run(Scheduler(datasets or {}, callbacks, semaphore).run(save, lambda name: report(name, 'failed')))
+    finally:
+        # whatever is ready is written even if some sheets failed
+        try:
+            spreadsheet.flush()
+        except Exception:
+            for name in [name for name, state in states.items() if state == 'ready']:
+                report(name, 'failed')
+            raise
+        for name in [name for name, state in states.items() if state == 'ready']:
+            report(name, 'saved')
+        logger.info('Results saved')
                 
 def get_data_rows_and_columns_count(data: dict) -> tuple[int, int]:
     count_rows_data = len(data)
@@ -0,0 +1,116 @@
+import os
+from email.utils import parsedate_to_datetime
+from time import time, sleep
+import requests
+from loguru import logger
+from src.cache import connect
+
+# Лимиты запросов в секунду и размер "пачки" для каждого семейства методов.
+# Переопределяются переменными RATE_LIMIT_<FAMILY> и RATE_BURST_<FAMILY>
+FAMILIES = {
+    'seller': (10, 10),
+    'analytics': (1, 1),
+    'finance': (5, 5),
+    'performance': (5, 5),
+}
+LIMITS = {
+    family: (
+        float(os.environ.get(f'RATE_LIMIT_{family.upper()}', rate)),
+        float(os.environ.get(f'RATE_BURST_{family.upper()}', burst))
+    )
+    for family, (rate, burst) in FAMILIES.items()
+}
+# Сколько раз повторять запрос, на который ответили 429
+RATE_LIMIT_RETRIES = int(os.environ.get('RATE_LIMIT_RETRIES', 10))
+
+
+def endpoint_family(url: str) -> str | None:
+    if 'performance.ozon.ru' in url:
+        return 'performance'
+    if 'api-seller.ozon.ru' not in url:
+        return None
+    if '/analytics/' in url:
+        return 'analytics'
+    if '/finance/' in url:
+        return 'finance'
+    return 'seller'
+
+
+_table_created = False
+
+
+def _create_table(db):
+    global _table_created
+    if _table_created:
+        return
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS rate_limits (
+            key TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            blocked_until REAL NOT NULL
+        )
+    ''')
+    _table_created = True
+
+
+def acquire(family: str, account: str):
+    '''Waits for a free slot in the token bucket of the endpoint family of the account.
+    Buckets are kept in the cache file, so all worker processes share them
+    '''
+    rate, burst = LIMITS[family]
+    key = f'{family}:{account}'
+    while True:
+        with connect() as db:
+            _create_table(db)
+            db.execute('BEGIN IMMEDIATE')
+            row = db.execute('SELECT tokens, updated_at, blocked_until FROM rate_limits WHERE key = ?', [key]).fetchone()
+            now = time()
+            tokens, updated_at, blocked_until = row if row else (burst, now, 0)
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+
+            if blocked_until > now:
+                wait = blocked_until - now
+            elif tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / rate
+
+            db.execute(
+                'INSERT OR REPLACE INTO rate_limits (key, tokens, updated_at, blocked_until) VALUES (?, ?, ?, ?)',
+                [key, tokens, now, blocked_until]
+            )
+
+        if not wait:
+            return
+        sleep(wait)
+
+
+def block(family: str, account: str, seconds: float):
+    '''Stops every process from calling the endpoint family of the account for seconds'''
+    key = f'{family}:{account}'
+    with connect() as db:
+        _create_table(db)
+        db.execute('BEGIN IMMEDIATE')
+        now = time()
+        row = db.execute('SELECT blocked_until FROM rate_limits WHERE key = ?', [key]).fetchone()
+        blocked_until = row[0] if row else 0
+        db.execute(
+            'INSERT OR REPLACE INTO rate_limits (key, tokens, updated_at, blocked_until) VALUES (?, ?, ?, ?)',
+            [key, 0, now, max(blocked_until, now + seconds)]
+        )
+
+
+def retry_after(response: requests.Response, attempt: int) -> float:
+    '''Seconds from the Retry-After header or an exponential delay if there is none'''
+    value = response.headers.get('Retry-After')
+    if value:
+        try:
+            return max(float(value), 0)
+        except ValueError:
+            try:
+                return max(parsedate_to_datetime(value).timestamp() - time(), 0)
+            except (TypeError, ValueError):
+                logger.warning(f'Unknown Retry-After: {value}')
+    return min(2 ** attempt, 60)
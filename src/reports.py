@@ -0,0 +1,115 @@
+import os
+import threading
+from concurrent.futures import Future
+from time import monotonic, sleep
+from typing import Callable
+from loguru import logger
+
+# Задержки между опросами статуса отчетов (секунды): начальная, множитель, максимальная
+POLL_DELAY = float(os.environ.get('REPORT_POLL_DELAY', 1))
+POLL_BACKOFF = float(os.environ.get('REPORT_POLL_BACKOFF', 1.5))
+POLL_MAX_DELAY = float(os.environ.get('REPORT_POLL_MAX_DELAY', 10))
+# Сколько ждать готовности одного отчета
+REPORT_TIMEOUT = float(os.environ.get('REPORT_TIMEOUT', 600))
+
+
+class ReportError(Exception):
+    pass
+
+
+class ReportJobs:
+    '''Keeps async reports of one run.
+
+    Reports are submitted by name, each one once. All submitted codes are polled
+    together in one background loop with a growing delay, and every report
+    is handed back through its Future as soon as it is ready.
+
+    check(code) returns the report result (e.g. file url) when it is ready,
+    None while it is being built and raises ReportError if it has failed
+    '''
+
+    def __init__(
+        self,
+        check: Callable[[str], object | None],
+        delay: float = POLL_DELAY,
+        max_delay: float = POLL_MAX_DELAY,
+        timeout: float = REPORT_TIMEOUT
+    ):
+        self.__check = check
+        self.__initial_delay = delay
+        self.__max_delay = max_delay
+        self.__timeout = timeout
+        self.__jobs: dict[str, Future] = {}
+        self.__pending: dict[str, tuple[Future, float]] = {}
+        self.__lock = threading.Lock()
+        self.__poller = None
+        self.__delay = delay
+
+    def submit(self, name: str, create: Callable[[], str | None]) -> Future:
+        '''Creates the report with create() (returns the report code) unless
+        a report with this name is already submitted. The Future gives the report result
+        '''
+        with self.__lock:
+            if name in self.__jobs:
+                return self.__jobs[name]
+            future = self.__jobs[name] = Future()
+
+        try:
+            code = create()
+        except Exception as e:
+            future.set_exception(e)
+            return future
+
+        if not code:
+            future.set_result(None)
+            return future
+
+        logger.debug(f'Report {name} is submitted: {code}')
+        with self.__lock:
+            self.__pending[code] = (future, monotonic() + self.__timeout)
+            self.__delay = self.__initial_delay
+            if self.__poller is None:
+                self.__poller = threading.Thread(target=self.__poll, daemon=True)
+                self.__poller.start()
+
+        return future
+
+    def result(self, name: str, create: Callable[[], str | None]) -> object | None:
+        '''Submits the report if needed and waits for its result'''
+        return self.submit(name, create).result()
+
+    def __poll(self):
+        while True:
+            with self.__lock:
+                if not self.__pending:
+                    self.__poller = None
+                    return
+                pending = list(self.__pending.items())
+                delay = self.__delay
+                self.__delay = min(delay * POLL_BACKOFF, self.__max_delay)
+
+            sleep(delay)
+
+            for code, (future, deadline) in pending:
+                try:
+                    result = self.__check(code)
+                except ReportError as e:
+                    self.__finish(code, error=e)
+                    continue
+                except Exception:
+                    logger.exception(f'Failed to get status of report {code}')
+                    result = None
+
+                if result is not None:
+                    logger.debug(f'Report {code} is ready')
+                    self.__finish(code, result=result)
+                elif monotonic() > deadline:
+                    self.__finish(code, error=ReportError(f'Report {code} is not ready in {self.__timeout}s'))
+
+    def __finish(self, code: str, result: object | None = None, error: Exception | None = None):
+        with self.__lock:
+            future, _ = self.__pending.pop(code)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
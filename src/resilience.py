@@ -0,0 +1,132 @@
+import os
+import random
+import threading
+from collections import Counter
+from time import monotonic, sleep
+from typing import Callable
+from urllib.parse import urlsplit
+import requests
+from loguru import logger
+
+# Повторы идемпотентных запросов: количество, базовая и максимальная задержка (секунды)
+HTTP_RETRIES = int(os.environ.get('HTTP_RETRIES', 3))
+RETRY_BASE_DELAY = float(os.environ.get('RETRY_BASE_DELAY', 0.5))
+RETRY_MAX_DELAY = float(os.environ.get('RETRY_MAX_DELAY', 30))
+# После скольких ошибок подряд хост считается недоступным и на сколько секунд
+BREAKER_FAILURES = int(os.environ.get('BREAKER_FAILURES', 5))
+BREAKER_RESET = float(os.environ.get('BREAKER_RESET', 30))
+
+# Запросы, которые создают что-то на стороне маркетплейса, не повторяются
+NOT_IDEMPOTENT = ('/create', '/generate')
+
+_counters = Counter()
+_counters_lock = threading.Lock()
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    pass
+
+
+def _count(name: str, host: str):
+    with _counters_lock:
+        _counters[f'{name}:{host}'] += 1
+
+
+def counters() -> dict:
+    '''Retry and circuit breaker counters of the process: {"<counter>:<host>": count}'''
+    with _counters_lock:
+        return dict(_counters)
+
+
+class CircuitBreaker:
+    '''Fails requests to a host fast after BREAKER_FAILURES errors in a row.
+    After BREAKER_RESET seconds one trial request is let through: if it succeeds
+    the host is considered healthy again, otherwise it stays open
+    '''
+
+    def __init__(self, host: str):
+        self.__host = host
+        self.__failures = 0
+        self.__opened_at = None
+        self.__trial = False
+        self.__lock = threading.Lock()
+
+    def check(self):
+        with self.__lock:
+            if self.__opened_at is None:
+                return
+            if monotonic() - self.__opened_at >= BREAKER_RESET and not self.__trial:
+                self.__trial = True
+                return
+        _count('breaker_rejected', self.__host)
+        raise CircuitOpenError(f'{self.__host} is unavailable, requests are not sent for now')
+
+    def success(self):
+        with self.__lock:
+            self.__failures = 0
+            self.__opened_at = None
+            self.__trial = False
+
+    def failure(self):
+        with self.__lock:
+            self.__failures += 1
+            if self.__trial or self.__failures >= BREAKER_FAILURES:
+                if self.__opened_at is None or self.__trial:
+                    _count('breaker_opened', self.__host)
+                    logger.warning(f'Circuit breaker for {self.__host} is open')
+                self.__opened_at = monotonic()
+                self.__trial = False
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(host: str) -> CircuitBreaker:
+    with _breakers_lock:
+        if host not in _breakers:
+            _breakers[host] = CircuitBreaker(host)
+        return _breakers[host]
+
+
+def is_idempotent(method: str, url: str) -> bool:
+    return method == 'GET' or not any(part in url for part in NOT_IDEMPOTENT)
+
+
+def call(method: str, url: str, send: Callable[[], requests.Response]) -> requests.Response:
+    '''Sends the request with send() through the circuit breaker of the host.
+    Idempotent requests are repeated with exponential backoff and full jitter
+    on connection errors, timeouts and 5xx responses
+    '''
+    host = urlsplit(url).netloc
+    breaker = get_breaker(host)
+    attempts = HTTP_RETRIES + 1 if is_idempotent(method, url) else 1
+
+    for attempt in range(attempts):
+        breaker.check()
+        error = response = None
+        try:
+            response = send()
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            error = e
+        except BaseException:
+            # not retried, but the breaker must not be left waiting for a trial which never ends
+            breaker.failure()
+            raise
+        else:
+            if response.status_code < 500:
+                breaker.success()
+                return response
+        breaker.failure()
+
+        if attempt == attempts - 1:
+            if error is not None:
+                raise error
+            return response
+
+        if response is not None:
+            response.close()
+        delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+        _count('retries', host)
+        logger.warning(f'{method} {url} failed ({error or response.status_code}), retry in {delay:.1f}s')
+        sleep(delay)
@@ -0,0 +1,108 @@
+import hashlib
+import os
+from itertools import islice
+from typing import Iterable, Iterator
+from time import time
+from src.cache import connect, CACHE_PATH
+
+# Через сколько секунд индекс листа перестраивается по его реальному содержимому
+ROW_INDEX_TTL = float(os.environ.get('ROW_INDEX_TTL', 24 * 3600))
+
+PERIOD_HEADER = 'Дата начала выгрузки'
+
+
+def row_digest(row: list) -> bytes:
+    '''Fixed-size digest of a row. Trailing empty cells do not change it'''
+    cells = [str(c) for c in row]
+    while cells and cells[-1] == '':
+        cells.pop()
+    return hashlib.blake2b('\x1f'.join(cells).encode(), digest_size=16).digest()
+
+
+class RowIndex:
+    '''Digests of the rows of one worksheet kept in the cache file.
+
+    With the index a write only needs the digests of the new rows: duplicates
+    are found without downloading the worksheet and the first free row is known.
+    The index is rebuilt from the worksheet when it is missing or older than ROW_INDEX_TTL
+    '''
+
+    def __init__(self, key: str, path: str = CACHE_PATH):
+        self.__key = key
+        self.__path = path
+
+        with connect(self.__path) as db:
+            db.execute('''
+                CREATE TABLE IF NOT EXISTS sheet_rows (
+                    sheet TEXT NOT NULL,
+                    digest BLOB NOT NULL,
+                    PRIMARY KEY (sheet, digest)
+                ) WITHOUT ROWID
+            ''')
+            db.execute('''
+                CREATE TABLE IF NOT EXISTS sheet_state (
+                    sheet TEXT PRIMARY KEY,
+                    row_count INTEGER NOT NULL,
+                    period_header INTEGER NOT NULL,
+                    built_at REAL NOT NULL
+                )
+            ''')
+
+    def state(self) -> dict | None:
+        '''{"row_count", "period_header"} of the worksheet or None if the index must be rebuilt'''
+        with connect(self.__path) as db:
+            row = db.execute(
+                'SELECT row_count, period_header, built_at FROM sheet_state WHERE sheet = ?', [self.__key]
+            ).fetchone()
+        if row is None or time() - row[2] > ROW_INDEX_TTL:
+            return None
+        return {'row_count': row[0], 'period_header': bool(row[1])}
+
+    def rebuild(self, rows: list[list]):
+        with connect(self.__path) as db:
+            db.execute('DELETE FROM sheet_rows WHERE sheet = ?', [self.__key])
+            db.executemany(
+                'INSERT OR IGNORE INTO sheet_rows (sheet, digest) VALUES (?, ?)',
+                ((self.__key, row_digest(r)) for r in rows)
+            )
+            db.execute(
+                'INSERT OR REPLACE INTO sheet_state (sheet, row_count, period_header, built_at) VALUES (?, ?, ?, ?)',
+                [self.__key, len(rows), bool(rows and rows[0] and rows[0][0] == PERIOD_HEADER), time()]
+            )
+
+    def contains(self, digests: list[bytes]) -> set[bytes]:
+        '''The digests which are already in the worksheet'''
+        found = set()
+        with connect(self.__path) as db:
+            for i in range(0, len(digests), 500):
+                chunk = digests[i:i + 500]
+                found.update(d for (d,) in db.execute(
+                    'SELECT digest FROM sheet_rows WHERE sheet = ? AND digest IN ({})'.format(', '.join('?' * len(chunk))),
+                    [self.__key, *chunk]
+                ))
+        return found
+
+    def append(self, rows: list[list]):
+        '''Registers rows written after the last row of the worksheet'''
+        with connect(self.__path) as db:
+            db.executemany(
+                'INSERT OR IGNORE INTO sheet_rows (sheet, digest) VALUES (?, ?)',
+                ((self.__key, row_digest(r)) for r in rows)
+            )
+            db.execute(
+                'UPDATE sheet_state SET row_count = row_count + ? WHERE sheet = ?', [len(rows), self.__key]
+            )
+
+
+def unique_rows(rows: Iterable[list], index: RowIndex, seen: set[bytes]) -> Iterator[list]:
+    '''Yields the rows which are neither in the worksheet nor in seen, keeping their order.
+    Rows are looked up in the index by chunks, only their digests are kept in seen
+    '''
+    rows = iter(rows)
+    while chunk := list(islice(rows, 500)):
+        digests = [row_digest(r) for r in chunk]
+        existing = index.contains(list(set(digests) - seen))
+        for row, digest in zip(chunk, digests):
+            if digest not in seen and digest not in existing:
+                seen.add(digest)
+                yield row
@@ -0,0 +1,115 @@
+import asyncio
+from time import monotonic
+from typing import Callable
+from loguru import logger
+from src.engine import CONCURRENCY, call
+
+
+class Scheduler:
+    '''Runs sheets and the datasets they are built from as a DAG.
+
+    Datasets and sheets are described the same way:
+        {
+            "Name": {
+                "GetData": function (required),
+                "Needs": ["dataset", ...] (optional),
+                "Blocking": True (optional, GetData blocks and must run in a thread)
+            }
+        }
+    A node starts as soon as everything it needs is ready and gets the results
+    of its needs as positional args. A dataset is fetched once no matter how
+    many sheets need it, and only if at least one sheet does.
+    '''
+
+    def __init__(self, datasets: dict, sheets: dict, semaphore: asyncio.Semaphore | None = None):
+        self.__datasets = datasets
+        self.__sheets = sheets
+        self.__nodes = {**datasets, **sheets}
+        self.__semaphore = semaphore
+        self.__tasks = {}
+        self.__timings = {}
+
+        self.__check_graph()
+
+    def __check_graph(self):
+        for name in self.__sheets:
+            if name in self.__datasets:
+                raise ValueError(f'{name} is both a sheet and a dataset')
+
+        done, visiting = set(), set()
+
+        def visit(name: str):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f'Dependency cycle through {name}')
+            visiting.add(name)
+            for need in self.__nodes[name].get('Needs', []):
+                if need not in self.__datasets:
+                    raise ValueError(f'{name} needs unknown dataset {need}')
+                visit(need)
+            visiting.remove(name)
+            done.add(name)
+
+        for name in self.__nodes:
+            visit(name)
+
+    def __task(self, name: str) -> asyncio.Task:
+        if name not in self.__tasks:
+            self.__tasks[name] = asyncio.ensure_future(self.__run_node(name))
+        return self.__tasks[name]
+
+    async def __run_node(self, name: str):
+        node = self.__nodes[name]
+        args = await asyncio.gather(*(self.__task(need) for need in node.get('Needs', [])))
+        start = monotonic()
+        try:
+            return await call(node["GetData"], *args, semaphore=self.__semaphore, blocking=node.get("Blocking", False))
+        finally:
+            self.__timings[name] = (start, monotonic())
+
+    async def run(self, save: Callable[[str, list | None], None], failed: Callable[[str], None] | None = None):
+        '''Builds every sheet and passes its data to save as soon as it is ready.
+        Saves are done one by one. Sheets which could not be built are passed to failed
+        and saved with no data. The critical path of the run is logged at the end
+        '''
+        self.__semaphore = self.__semaphore or asyncio.Semaphore(CONCURRENCY)
+        save_lock = asyncio.Lock()
+        started = monotonic()
+
+        async def sheet(sheet_name: str):
+            try:
+                data = await self.__task(sheet_name)
+            except Exception:
+                logger.exception(f'Failed to parse {sheet_name}')
+                if failed:
+                    failed(sheet_name)
+                data = None
+
+            async with save_lock:
+                await asyncio.to_thread(save, sheet_name, data)
+
+        await asyncio.gather(*(sheet(name) for name in self.__sheets))
+
+        path = self.critical_path()
+        if path:
+            logger.info('Critical path ({:.1f}s): {}'.format(
+                self.__timings[path[-1]][1] - started,
+                ' -> '.join(f'{name} {end - start:.1f}s' for name, (start, end) in
+                            ((name, self.__timings[name]) for name in path))
+            ))
+
+    def critical_path(self) -> list[str]:
+        '''The chain of nodes which finished last: the latest sheet and, going back,
+        the latest of the datasets each node was waiting for
+        '''
+        finished = [name for name in self.__sheets if name in self.__timings]
+        if not finished:
+            return []
+
+        path = [max(finished, key=lambda name: self.__timings[name][1])]
+        while True:
+            needs = [need for need in self.__nodes[path[0]].get('Needs', []) if need in self.__timings]
+            if not needs:
+                return path
+            path.insert(0, max(needs, key=lambda name: self.__timings[name][1]))
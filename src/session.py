@@ -0,0 +1,60 @@
+import os
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Размеры пулов соединений на один хост
+POOL_CONNECTIONS = int(os.environ.get('HTTP_POOL_CONNECTIONS', 10))
+POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', 20))
+
+# Таймауты (connect, read) в секундах
+TIMEOUT = (
+    float(os.environ.get('HTTP_CONNECT_TIMEOUT', 10)),
+    float(os.environ.get('HTTP_READ_TIMEOUT', 120))
+)
+
+_sessions: dict[str, requests.Session] = {}
+_lock = threading.Lock()
+
+
+def get_session(url: str) -> requests.Session:
+    '''Returns a keep-alive session for the host of the url.
+    Sessions live as long as the process does, so every parser and every run
+    in the same worker reuses already opened connections
+    '''
+    host = urlsplit(url).netloc
+    session = _sessions.get(host)
+    if session is not None:
+        return session
+
+    with _lock:
+        if host not in _sessions:
+            _sessions[host] = _create_session()
+        return _sessions[host]
+
+
+def _create_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def close_sessions():
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def _reset_after_fork():
+    global _lock
+    _lock = threading.Lock()
+    _sessions.clear()
+
+
+# Сокеты родителя нельзя использовать в дочернем процессе
+os.register_at_fork(after_in_child=_reset_after_fork)
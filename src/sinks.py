@@ -0,0 +1,147 @@
+import os
+import re
+import sqlite3
+from abc import ABC, abstractmethod
+from datetime import datetime
+import pandas as pd
+from loguru import logger
+from src.row_index import row_digest
+
+# Каталог локальных выгрузок (SQLite и Parquet), если у магазина не задан свой путь
+SINK_DIR = os.environ.get('SINK_DIR', 'output')
+
+SINKS = ('gsheet', 'sqlite', 'parquet')
+
+
+class Sink(ABC):
+    '''Destination of the parsed sheets.
+
+    put_data_in_ws is called for every ready sheet, flush once at the end of the run
+    '''
+
+    @abstractmethod
+    def put_data_in_ws(self, data: list[list], worksheet_name: str):
+        ...
+
+    def flush(self):
+        pass
+
+
+class SQLiteSink(Sink):
+    '''Appends the sheets to tables of a local SQLite file, one table per sheet.
+
+    Rows get shop, period and load time columns, data columns are named c1, c2, ...
+    Rows which are already in the table for the shop are skipped
+    '''
+
+    def __init__(self, path: str, shop: str, date_start: datetime, date_end: datetime):
+        self.__path = path
+        self.__shop = shop
+        self.__date_start = date_start.isoformat()
+        self.__date_end = date_end.isoformat()
+        self.__pending: dict[str, list[list]] = {}
+
+    def put_data_in_ws(self, data: list[list], worksheet_name: str):
+        self.__pending.setdefault(worksheet_name, []).extend(data)
+
+    def flush(self):
+        pending, self.__pending = self.__pending, {}
+        if not pending:
+            return
+
+        os.makedirs(os.path.dirname(self.__path) or '.', exist_ok=True)
+        loaded_at = datetime.now().isoformat(timespec='seconds')
+        db = sqlite3.connect(self.__path, timeout=30)
+        try:
+            with db:
+                for name, rows in pending.items():
+                    table = '"{}"'.format(name.replace('"', '""'))
+                    width = max(map(len, rows))
+                    self.__prepare_table(db, table, width)
+
+                    columns = ', '.join(f'c{i}' for i in range(1, width + 1))
+                    db.executemany(
+                        f'INSERT OR IGNORE INTO {table} (shop, date_start, date_end, loaded_at, digest, {columns}) '
+                        f'VALUES (?, ?, ?, ?, ?, {", ".join("?" * width)})',
+                        (
+                            [self.__shop, self.__date_start, self.__date_end, loaded_at, row_digest(r),
+                             *r, *[None] * (width - len(r))]
+                            for r in rows
+                        )
+                    )
+        finally:
+            db.close()
+        logger.debug(f'{sum(map(len, pending.values()))} rows written to {self.__path}')
+
+    def __prepare_table(self, db: sqlite3.Connection, table: str, width: int):
+        db.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                shop TEXT NOT NULL,
+                date_start TEXT NOT NULL,
+                date_end TEXT NOT NULL,
+                loaded_at TEXT NOT NULL,
+                digest BLOB NOT NULL,
+                UNIQUE (shop, digest)
+            )
+        ''')
+        existing = {row[1] for row in db.execute(f'PRAGMA table_info({table})')}
+        for i in range(1, width + 1):
+            if f'c{i}' not in existing:
+                db.execute(f'ALTER TABLE {table} ADD COLUMN c{i}')
+
+
+class ParquetSink(Sink):
+    '''Writes every sheet of a run to its own Parquet file:
+    <directory>/<shop>/<sheet>/<start>_<end>_<load time>.parquet
+    '''
+
+    def __init__(self, directory: str, shop: str, date_start: datetime, date_end: datetime):
+        import pyarrow  # noqa: F401 fail before the run, not after it
+
+        self.__directory = directory
+        self.__shop = shop
+        self.__period = f'{date_start:%Y%m%d}_{date_end:%Y%m%d}'
+        self.__pending: dict[str, list[list]] = {}
+
+    def put_data_in_ws(self, data: list[list], worksheet_name: str):
+        self.__pending.setdefault(worksheet_name, []).extend(data)
+
+    def flush(self):
+        pending, self.__pending = self.__pending, {}
+        loaded_at = datetime.now()
+
+        for name, rows in pending.items():
+            directory = os.path.join(self.__directory, _file_name(self.__shop), _file_name(name))
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f'{self.__period}_{loaded_at:%Y%m%dT%H%M%S%f}.parquet')
+
+            frame = pd.DataFrame(rows)
+            frame.columns = [f'c{i}' for i in range(1, len(frame.columns) + 1)]
+            frame.apply(_parquet_column).to_parquet(path, index=False)
+            logger.debug(f'{len(rows)} rows written to {path}')
+
+
+def _file_name(name: str) -> str:
+    return re.sub(r'[^\w\-. ]', '_', name)
+
+
+def _parquet_column(column: pd.Series) -> pd.Series:
+    # Parquet columns have one type, cells like "-" or "Нет данных" in numeric columns make them text
+    if pd.api.types.infer_dtype(column, skipna=True) in ('integer', 'floating', 'mixed-integer-float', 'boolean', 'string', 'empty'):
+        return column
+    return column.map(lambda v: v if v is None else str(v))
+
+
+def create_sink(kind: str, startDate: datetime, endDate: datetime, spreadsheet_url: str | None = None,
+                path: str | None = None, shop: str = '') -> Sink:
+    '''Sink of a market: "gsheet" (default), "sqlite" or "parquet"'''
+    kind = (kind or 'gsheet').lower()
+
+    if kind == 'gsheet':
+        from src.g_functions import GSheet
+        return GSheet.create(spreadsheet_url, startDate, endDate)
+    if kind == 'sqlite':
+        return SQLiteSink(path or os.path.join(SINK_DIR, 'statistics.sqlite3'), shop, startDate, endDate)
+    if kind == 'parquet':
+        return ParquetSink(path or SINK_DIR, shop, startDate, endDate)
+    raise ValueError(f'Unknown sink {kind}, expected one of {SINKS}')
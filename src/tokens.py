@@ -0,0 +1,72 @@
+import os
+import threading
+from contextlib import contextmanager
+from time import time
+from typing import Callable
+from loguru import logger
+from src.cache import DiskCache, file_lock
+
+# За сколько секунд до истечения токена его нужно обновить
+TOKEN_REFRESH_MARGIN = float(os.environ.get('TOKEN_REFRESH_MARGIN', 300))
+
+_tokens: dict[str, dict] = {}
+_locks: dict[str, threading.Lock] = {}
+_locks_lock = threading.Lock()
+
+
+@contextmanager
+def _refresh_lock(client_id: str):
+    '''Only one thread of one process refreshes the token of a client at a time'''
+    with _locks_lock:
+        lock = _locks.setdefault(client_id, threading.Lock())
+
+    with lock, file_lock(f'token:{client_id}'):
+        yield
+
+
+def _is_fresh(token: dict | None) -> bool:
+    return token is not None and token['expires_at'] - time() > TOKEN_REFRESH_MARGIN
+
+
+def get_token(client_id: str, request_token: Callable[[], dict]) -> str:
+    '''Returns the performance API access token of the client.
+
+    Tokens are shared by every process through the disk cache and are refreshed
+    TOKEN_REFRESH_MARGIN seconds before they expire. request_token() must return
+    the json of /api/client/token, it is called by one job at a time while the
+    others wait for its result.
+    '''
+    token = _tokens.get(client_id)
+    if _is_fresh(token):
+        return token['access_token']
+
+    cache = DiskCache('performance_tokens', float('inf'))
+    with _refresh_lock(client_id):
+        token = cache.get_many([client_id]).get(client_id)
+        if not _is_fresh(token):
+            logger.debug(f'Refreshing performance token of {client_id}')
+            response = request_token()
+            token = {
+                'access_token': response['access_token'],
+                'expires_at': time() + float(response.get('expires_in', 1800))
+            }
+            cache.set_many({client_id: token})
+
+    _tokens[client_id] = token
+    return token['access_token']
+
+
+def invalidate_token(client_id: str, access_token: str):
+    '''Forgets the token after the API rejected it, the next get_token() requests a new one.
+    A token which another job has already refreshed is kept
+    '''
+    cache = DiskCache('performance_tokens', float('inf'))
+    with _refresh_lock(client_id):
+        # several threads may get 401 with the same token, only the first one drops it
+        if _tokens.get(client_id, {}).get('access_token') == access_token:
+            _tokens.pop(client_id, None)
+
+        token = cache.get_many([client_id]).get(client_id)
+        if token is not None and token['access_token'] == access_token:
+            logger.debug(f'Dropping rejected performance token of {client_id}')
+            cache.delete_many([client_id])
@@ -17,18 +17,26 @@ class Parser(OzonParser):
         self.__token = token
         self.__date_from = date_from
         self.__date_to = date_to
+        # Wildberries endpoints are not rate limited by the Ozon families
+        self.__rate_accounts = {}
 
-    def __r(self, method, url: str, json: dict = None) -> requests.Response:
+    def start_reports(self):
+        '''Wildberries has no async reports, every sheet is built on request'''
+
+    def close(self):
+        '''Wildberries requests are not fanned out, there is nothing to stop'''
+
+    def __r(self, method: str, url: str, json: dict = None, stream: bool = False) -> requests.Response:
         headers = {
             "Authorization": self.__token
         }
-        return super().__r(method, url, headers, json)
+        return super().__r(method, url, json=json, headers=headers, stream=stream)
 
     def __p(self, url: str, json: dict = None) -> requests.Response:
-        return self.__r(requests.post, url, json)
+        return self.__r('POST', url, json)
     
-    def __g(self, url: str, json: dict = None) -> requests.Response:
-        return self.__r(requests.get, url, json)
+    def __g(self, url: str, json: dict = None, stream: bool = False) -> requests.Response:
+        return self.__r('GET', url, json, stream)
         
     def create_products_report(self) -> list[list]:
         payload = {
@@ -502,8 +510,9 @@ class Parser(OzonParser):
             return s
         return '-'
     
-    def create_supply_report(self):
-        goods = self.create_postings_report('fbo') + self.create_postings_report('fbs')
+    def create_supply_report(self, goods: list[list] | None = None):
+        if goods is None:
+            goods = self.create_postings_report('fbo') + self.create_postings_report('fbs')
         if not goods:
             return []
         whs_stocks = self.__get_stock_on_warehouses()
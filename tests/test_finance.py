@@ -0,0 +1,135 @@
+import random
+from src.finance import prepare_order_incomes
+
+SERVICES = [
+    'MarketplaceNotDeliveredCostItem',
+    'MarketplaceReturnAfterDeliveryCostItem',
+    'MarketplaceServiceItemReturnAfterDelivToCustomer',
+    'MarketplaceServiceItemReturnNotDelivToCustomer',
+    'MarketplaceServiceItemReturnPartGoodsCustomer',
+    'MarketplaceServiceItemDirectFlowLogistic',
+    'MarketplaceServiceItemReturnFlowLogistic',
+    'MarketplaceServiceItemDirectFlowTrans',
+    'MarketplaceServiceItemDelivToCustomer',
+    'MarketplaceServiceItemReturnFlowTrans',
+    'MarketplaceServiceItemPickup',
+    'MarketplaceServiceItemDropoffPPZ',
+]
+
+
+def cnv_bool(s, value_if_true: bool = False):
+    if s:
+        if not value_if_true:
+            return '+'
+        return s
+    return '-'
+
+
+def old_prepare_order_incomes(data: list[dict], warehouse_names: dict, good_info: dict) -> list[list]:
+    '''Parser.__prepare_order_incomes before src.finance'''
+    result = []
+
+    def getServicePrice(name: str, item: dict) -> float:
+        for i in item['services']:
+            if name in i:
+                return i[name]['price']
+            # the old loop only read {name: {"price": ...}}, the {"name", "price"} format is read since src.finance
+            if i.get('name') == name:
+                return i.get('price', 0)
+        return 0
+
+    for item in data:
+        services_str = str(item['services'])
+        goods_num = len(item['items'])
+        for good in item['items']:
+            row = [
+                item['operation_date'],
+                item['operation_type_name'],
+                item['operation_id'],
+                item['posting']['order_date'],
+                warehouse_names[item['posting']['warehouse_id']],
+                item['operation_date'],
+                good['sku'],
+                good_info[good['sku']]['offer_id'],
+                good_info[good['sku']]['name'],
+                1,
+                cnv_bool('MarketplaceNotDeliveredCostItem' in services_str or 'MarketplaceReturnAfterDeliveryCostItem' in services_str),
+                item['sale_commission'],
+                item['posting']['posting_number'],
+                'Pick-Up' if 'MarketplaceServiceItemPickup' in services_str else (
+                    'Drop-off' if 'MarketplaceServiceItemDropoffPPZ' in services_str else 'Нет данных'),
+                cnv_bool(getServicePrice('MarketplaceServiceItemDirectFlowTrans', item) / goods_num, True),
+                cnv_bool(getServicePrice('MarketplaceServiceItemDelivToCustomer', item) / goods_num, True),
+                cnv_bool(getServicePrice('MarketplaceServiceItemReturnFlowTrans', item) / goods_num, True),
+                cnv_bool('MarketplaceServiceItemReturnAfterDelivToCustomer' in services_str),
+                cnv_bool('MarketplaceServiceItemReturnNotDelivToCustomer' in services_str),
+                cnv_bool('MarketplaceServiceItemReturnPartGoodsCustomer' in services_str),
+                cnv_bool('MarketplaceServiceItemDirectFlowLogistic' in services_str),
+                'Нет данных',
+                cnv_bool('MarketplaceServiceItemReturnFlowLogistic' in services_str),
+                item['amount'] / goods_num
+            ]
+            result.append(row)
+
+    return result
+
+
+def make_operations(count: int, seed: int = 0) -> list[dict]:
+    rnd = random.Random(seed)
+    operations = []
+    for i in range(count):
+        names = rnd.sample(SERVICES, rnd.randint(0, 4))
+        if rnd.random() < 0.5:
+            services = [{'name': name, 'price': round(rnd.uniform(-100, 0), 2)} for name in names]
+        else:
+            services = [{name: {'price': round(rnd.uniform(-100, 0), 2)}} for name in names]
+        operations.append({
+            'operation_date': f'2024-06-{i % 30 + 1:02d} 00:00:00',
+            'operation_type_name': rnd.choice(['Доставка покупателю', 'Возврат', 'Услуги']),
+            'operation_id': 1000 + i,
+            'posting': {
+                'order_date': f'2024-05-{i % 30 + 1:02d} 00:00:00',
+                'warehouse_id': rnd.randint(1, 5),
+                'posting_number': f'{i}-0001-1',
+            },
+            'sale_commission': round(rnd.uniform(-50, 0), 2),
+            'amount': round(rnd.uniform(-500, 500), 2),
+            'items': [{'sku': rnd.randint(1, 50)} for _ in range(rnd.randint(0, 3))],
+            'services': services,
+        })
+    return operations
+
+
+WAREHOUSES = {i: f'Склад {i}' for i in range(1, 6)}
+GOODS = {sku: {'offer_id': f'offer-{sku}', 'name': f'Товар {sku}'} for sku in range(1, 51)}
+
+
+def test_same_rows_as_the_old_loop():
+    operations = make_operations(5000)
+    assert any(not op['items'] for op in operations)
+    assert any(not op['services'] for op in operations)
+
+    assert prepare_order_incomes(operations, WAREHOUSES, GOODS) == \
+        old_prepare_order_incomes(operations, WAREHOUSES, GOODS)
+
+
+def test_operations_without_services():
+    operations = [dict(op, services=[]) for op in make_operations(50, seed=1)]
+
+    assert prepare_order_incomes(operations, WAREHOUSES, GOODS) == \
+        old_prepare_order_incomes(operations, WAREHOUSES, GOODS)
+
+
+def test_operations_without_items():
+    operations = [dict(op, items=[]) for op in make_operations(50, seed=2)]
+
+    assert prepare_order_incomes(operations, WAREHOUSES, GOODS) == []
+    assert prepare_order_incomes([], WAREHOUSES, GOODS) == []
+
+
+def test_unknown_sku():
+    operations = make_operations(1, seed=3)
+    operations[0]['items'] = [{'sku': 999}]
+
+    row, = prepare_order_incomes(operations, WAREHOUSES, GOODS)
+    assert row[6:9] == [999, 'Нет данных', 'Нет данных']
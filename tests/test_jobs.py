@@ -0,0 +1,52 @@
+import multiprocessing
+import time
+import pytest
+from src import jobs, program
+
+pytestmark = pytest.mark.skipif(
+    multiprocessing.get_start_method() != 'fork', reason='the workers must inherit the patched program.execute'
+)
+
+
+def execute(progress=None, **params):
+    for i in range(params['sheets']):
+        progress(f'sheet {i}', 'saved')
+    if params.get('fail'):
+        raise RuntimeError('sync failed')
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    monkeypatch.setattr(program, 'execute', execute)
+    # every worker is recycled right after its job
+    monkeypatch.setattr(jobs, 'JOB_WORKER_MAX_JOBS', 1)
+    queue = jobs.JobQueue(workers=2, max_queued=100, account_limit=1)
+    yield queue
+    queue.close(1)
+
+
+def test_recycled_worker_jobs_are_not_failed(queue):
+    job_ids = [queue.submit(f'shop {i}', {'sheets': 300})['id'] for i in range(20)]
+
+    seen = set()
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        states = [queue.get(job_id)['state'] for job_id in job_ids]
+        seen.update(states)
+        if all(state in jobs.FINISHED for state in states):
+            break
+        time.sleep(0.01)
+
+    assert 'failed' not in seen
+    for job_id in job_ids:
+        job = queue.get(job_id)
+        assert job['state'] == 'done'
+        assert len(job['sheets']) == 300
+
+
+def test_failed_job(queue):
+    job = queue.submit('shop', {'sheets': 1, 'fail': True})
+    job, = queue.wait([job['id']], timeout=30)
+
+    assert job['state'] == 'failed'
+    assert job['error'] == 'RuntimeError: sync failed'
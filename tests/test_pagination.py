@@ -0,0 +1,51 @@
+from src.pagination import paginate, by_page, by_offset, by_last_id
+
+
+def test_paginate_follows_the_cursor_and_skips_empty_pages():
+    pages = {1: ([1, 2], 2), 2: ([], 3), 3: ([3], None)}
+    cursors = []
+
+    def fetch(cursor):
+        cursors.append(cursor)
+        return pages[cursor]
+
+    assert list(paginate(fetch, 1)) == [[1, 2], [3]]
+    assert cursors == [1, 2, 3]
+
+
+def test_by_page_stops_at_a_page_which_is_not_full():
+    requested = []
+
+    def fetch(page, page_size):
+        requested.append(page)
+        return list(range(page_size if page < 3 else 1))
+
+    assert [len(items) for items in by_page(fetch, 2)] == [2, 2, 1]
+    assert requested == [1, 2, 3]
+
+
+def test_by_offset():
+    items = list(range(7))
+
+    assert list(by_offset(lambda offset, limit: items[offset:offset + limit], 3)) == [[0, 1, 2], [3, 4, 5], [6]]
+
+
+def test_by_last_id_passes_the_last_id_of_the_page():
+    items = [f'id{i}' for i in range(5)]
+    requested = []
+
+    def fetch(last_id, limit):
+        requested.append(last_id)
+        start = items.index(last_id) + 1 if last_id else 0
+        page = items[start:start + limit]
+        return page, page[-1] if page else ''
+
+    assert list(by_last_id(fetch, 2, '')) == [['id0', 'id1'], ['id2', 'id3'], ['id4']]
+    assert requested == ['', 'id1', 'id3']
+
+
+def test_by_last_id_full_last_page():
+    # the API returns an empty page after the last full one
+    pages = {0: ([1, 2], 2), 2: ([], 0)}
+
+    assert list(by_last_id(lambda last_id, limit: pages[last_id], 2)) == [[1, 2]]
@@ -0,0 +1,57 @@
+import asyncio
+import pytest
+from src.scheduler import Scheduler
+
+
+def run(datasets: dict, sheets: dict) -> tuple[dict, list]:
+    saved, failed = {}, []
+    asyncio.run(Scheduler(datasets, sheets).run(saved.__setitem__, failed.append))
+    return saved, failed
+
+
+def test_dataset_is_fetched_once():
+    calls = []
+
+    async def postings():
+        calls.append('postings')
+        await asyncio.sleep(0.01)
+        return [[1], [2]]
+
+    saved, failed = run({
+        'postings': {'GetData': postings},
+        'unused': {'GetData': lambda: calls.append('unused')},
+    }, {
+        'Продажи': {'GetData': lambda rows: rows, 'Needs': ['postings']},
+        'Размещение': {'GetData': lambda rows: [r + ['x'] for r in rows], 'Needs': ['postings']},
+        'Товары': {'GetData': lambda: [['a']], 'Blocking': True},
+    })
+
+    assert calls == ['postings']
+    assert saved == {'Продажи': [[1], [2]], 'Размещение': [[1, 'x'], [2, 'x']], 'Товары': [['a']]}
+    assert failed == []
+
+
+def test_failed_dataset_fails_its_sheets():
+    async def postings():
+        raise ConnectionError('postings are not available')
+
+    saved, failed = run({
+        'postings': {'GetData': postings},
+    }, {
+        'Продажи': {'GetData': lambda rows: rows, 'Needs': ['postings']},
+        'Размещение': {'GetData': lambda rows: rows, 'Needs': ['postings']},
+        'Товары': {'GetData': lambda: [['a']]},
+    })
+
+    assert sorted(failed) == ['Продажи', 'Размещение']
+    assert saved == {'Продажи': None, 'Размещение': None, 'Товары': [['a']]}
+
+
+def test_graph_is_checked():
+    with pytest.raises(ValueError):
+        Scheduler({}, {'Продажи': {'GetData': list, 'Needs': ['postings']}})
+    with pytest.raises(ValueError):
+        Scheduler({
+            'a': {'GetData': list, 'Needs': ['b']},
+            'b': {'GetData': list, 'Needs': ['a']},
+        }, {})